@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+解析器扩展性基准测试
+
+生成合成 EPUB (数千个文档、单个超大文档、大量短文档，中英文混排)，分别计时各解析阶段
+并记录内存峰值，输出随输入规模变化的耗时曲线及其对数斜率(≈1 线性，≈2 平方级)。
+
+阶段:
+  load        读取 OPF spine 并逐个读取文档 (read_epub_spine + zip)
+  skip        对每个章节调用 should_skip_content
+  merge       merge_short_chapters
+  split       单章节整书的拆分与合并 (_finalize_chapters)
+  parse_epub  完整的 parse_epub (需要 beautifulsoup4)
+
+用法:
+    python bench_parser.py                       # 默认规模
+    python bench_parser.py --quick               # 较小规模，快速检查
+    python bench_parser.py --save-baseline base.json
+    python bench_parser.py --baseline base.json --tolerance 1.5   # 变慢超过 1.5 倍时返回非零
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+from parser import (read_epub_spine, should_skip_content, merge_short_chapters,
+                    _finalize_chapters, parse_epub)
+
+CJK_WORDS = ["我们", "今天", "故事", "世界", "时间", "城市", "朋友", "记忆", "远方", "声音", "夜晚", "开始"]
+LATIN_WORDS = ["the", "voice", "library", "chapter", "river", "night", "signal", "engine", "paper", "light"]
+
+# 场景: (名称, 各规模, 规模单位)
+SCENARIOS = {
+    "many_docs": ([250, 500, 1000, 2000, 4000], "docs"),
+    "short_docs": ([500, 1000, 2000, 4000, 8000], "docs"),
+    "giant_single": ([250_000, 500_000, 1_000_000, 2_000_000, 4_000_000], "chars"),
+}
+QUICK_SCENARIOS = {
+    "many_docs": ([100, 200, 400], "docs"),
+    "short_docs": ([200, 400, 800], "docs"),
+    "giant_single": ([100_000, 200_000, 400_000], "chars"),
+}
+
+def make_paragraph(rng: random.Random, length: int) -> str:
+    """Mixed CJK/Latin paragraph of roughly `length` characters ending with a sentence mark"""
+    parts, size = [], 0
+    while size < length:
+        if rng.random() < 0.6:
+            word = rng.choice(CJK_WORDS)
+        else:
+            word = " " + rng.choice(LATIN_WORDS) + " "
+        parts.append(word)
+        size += len(word)
+        if rng.random() < 0.08:
+            parts.append(rng.choice("。！？."))
+            size += 1
+    return "".join(parts) + "。"
+
+def make_document(rng: random.Random, chars: int, paragraph_chars: int = 300):
+    paragraphs = [make_paragraph(rng, paragraph_chars) for _ in range(max(1, chars // paragraph_chars))]
+    return paragraphs
+
+def write_epub(path: str, title: str, documents):
+    """Write a minimal EPUB 3 whose spine lists `documents` = [(heading, [paragraph, ...]), ...]"""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml",
+                    '<?xml version="1.0"?><container version="1.0" '
+                    'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                    '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                    '</rootfiles></container>')
+        manifest, spine = [], []
+        for i, (heading, paragraphs) in enumerate(documents):
+            name = f"text/doc{i:05d}.xhtml"
+            manifest.append(f'<item id="d{i}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="d{i}"/>')
+            body = f"<h2>{escape(heading)}</h2>" if heading else ""
+            body += "".join(f"<p>{escape(p)}</p>\n" for p in paragraphs)
+            zf.writestr(f"OEBPS/{name}",
+                        '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+                        f"<head><title>{escape(heading or title)}</title></head><body>{body}</body></html>")
+        # 图片资源应被解析器完全跳过
+        zf.writestr("OEBPS/images/cover.jpg", os.urandom(256 * 1024))
+        manifest.append('<item id="cover" href="images/cover.jpg" media-type="image/jpeg"/>')
+        zf.writestr("OEBPS/content.opf",
+                    '<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+                    f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{escape(title)}</dc:title></metadata>'
+                    f'<manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>')
+
+def build_scenario(name: str, size: int, rng: random.Random):
+    """Return (documents, chapters) for a scenario, chapters being the dicts parse_epub would produce"""
+    if name == "many_docs":
+        documents = [(f"第{i+1}章 合成章节", make_document(rng, 2000)) for i in range(size)]
+    elif name == "short_docs":
+        documents = [(f"Section {i+1}", make_document(rng, 400, 200)) for i in range(size)]
+    else:
+        documents = [(None, make_document(rng, size))]
+    chapters = [{"title": heading or "Chapter 1", "text": "\n\n".join(paragraphs)}
+                for heading, paragraphs in documents]
+    return documents, chapters
+
+def stage_load(epub_path: str):
+    with zipfile.ZipFile(epub_path) as zf:
+        _, names = read_epub_spine(zf)
+        for name in names:
+            zf.read(name)
+
+def run_stage(fn, repeat: int, measure_memory: bool):
+    """
+    Return (best seconds of `repeat` runs, peak MB).
+    Memory is measured in a separate run so tracing does not skew timing.
+    """
+    seconds = float("inf")
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    peak_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        fn()
+        peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return seconds, peak_mb
+
+def have_bs4() -> bool:
+    try:
+        import bs4  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def slope(points):
+    """log-log slope between the smallest and largest size (time ~ size^slope)"""
+    points = [(s, t) for s, t in points if t > 0]
+    if len(points) < 2:
+        return None
+    (s0, t0), (s1, t1) = points[0], points[-1]
+    return math.log(t1 / t0) / math.log(s1 / s0)
+
+def main():
+    parser = argparse.ArgumentParser(description='解析器扩展性基准测试')
+    parser.add_argument('--quick', action='store_true', help='使用较小的规模')
+    parser.add_argument('--scenario', choices=list(SCENARIOS), action='append', help='只运行指定场景 (可重复)')
+    parser.add_argument('--repeat', '-n', type=int, default=3, help='每个阶段重复次数，取最快一次 (默认: 3)')
+    parser.add_argument('--no-memory', action='store_true', help='不测量内存峰值')
+    parser.add_argument('--seed', type=int, default=1234, help='随机种子 (默认: 1234)')
+    parser.add_argument('--save-baseline', help='把本次结果保存为基线 JSON')
+    parser.add_argument('--baseline', help='与基线 JSON 比较')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='允许相对基线变慢的倍数 (默认: 1.5)')
+    args = parser.parse_args()
+
+    scenarios = QUICK_SCENARIOS if args.quick else SCENARIOS
+    selected = args.scenario or list(scenarios)
+    full_parse = have_bs4()
+    if not full_parse:
+        print("未安装 beautifulsoup4，跳过 parse_epub 阶段\n")
+
+    results = {}
+    print(f"{'scenario':<14}{'size':>10}{'stage':>12}{'seconds':>12}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in selected:
+            sizes, unit = scenarios[name]
+            for size in sizes:
+                rng = random.Random(args.seed)
+                documents, chapters = build_scenario(name, size, rng)
+                epub_path = os.path.join(workdir, f"{name}_{size}.epub")
+                write_epub(epub_path, f"{name} {size}", documents)
+
+                stages = {
+                    "load": lambda: stage_load(epub_path),
+                    "skip": lambda: [should_skip_content(c["title"], c["text"]) for c in chapters],
+                    "merge": lambda: merge_short_chapters(chapters),
+                }
+                if name == "giant_single":
+                    stages["split"] = lambda: _finalize_chapters([dict(chapters[0])])
+                if full_parse:
+                    stages["parse_epub"] = lambda: parse_epub(epub_path)
+
+                for stage, fn in stages.items():
+                    seconds, peak_mb = run_stage(fn, args.repeat, not args.no_memory)
+                    results[f"{name}/{size}/{stage}"] = {"seconds": seconds, "peak_mb": peak_mb}
+                    peak = f"{peak_mb:.1f}" if peak_mb is not None else "-"
+                    print(f"{name:<14}{size:>10}{stage:>12}{seconds:>12.4f}{peak:>10}")
+                os.remove(epub_path)
+
+    print("\n== 扩展性 (耗时随规模的对数斜率，≈1 线性，≈2 平方级) ==")
+    for name in selected:
+        sizes, unit = scenarios[name]
+        stages = sorted({key.split("/")[2] for key in results if key.startswith(name + "/")})
+        for stage in stages:
+            points = [(size, results[f"{name}/{size}/{stage}"]["seconds"]) for size in sizes]
+            k = slope(points)
+            curve = "  ".join(f"{size}{unit[0]}:{t*1000:.1f}ms" for size, t in points)
+            print(f"{name:<14}{stage:>12}  slope={k:.2f}  {curve}" if k is not None else f"{name:<14}{stage:>12}  -")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n基线已保存到 {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = []
+        for key, result in results.items():
+            base = baseline.get(key)
+            # 忽略极短的阶段，计时噪声太大
+            if base and base["seconds"] > 0.005 and result["seconds"] > base["seconds"] * args.tolerance:
+                regressions.append(f"{key}: {base['seconds']:.4f}s -> {result['seconds']:.4f}s")
+        if regressions:
+            print(f"\n发现性能回退 (超过基线 {args.tolerance} 倍):")
+            print("\n".join("  " + r for r in regressions))
+            return 1
+        print(f"\n与基线相比无性能回退 (容差 {args.tolerance} 倍)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+解析路径基准测试：进程内解析 vs Calibre 转换
+
+对 TXT/HTML/FB2 文件分别计时：
+  - native:  parse_book_file (进程内直接解析)
+  - calibre: convert_to_epub (ebook-convert) + parse_epub
+并对比两条路径得到的章节数，确认章节结构一致。
+
+用法:
+    python bench_parser_paths.py                 # 使用生成的示例文件
+    python bench_parser_paths.py book.txt a.fb2  # 使用指定文件
+    python bench_parser_paths.py --chapters 200 --runs 3
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+from parser import convert_to_epub, parse_book_file, parse_epub
+
+PARAGRAPH = ("这是用于基准测试的示例段落，包含中文与 English words mixed together。"
+             "第二句话继续描述故事的情节发展。") * 3
+
+def generate_samples(directory: str, chapters: int, paragraphs: int) -> list:
+    """Write sample .txt/.html/.fb2 books with the same content, return their paths"""
+    bodies = [[f"{PARAGRAPH} ({c}-{p})" for p in range(paragraphs)] for c in range(chapters)]
+
+    txt_path = os.path.join(directory, "sample.txt")
+    with open(txt_path, "w", encoding="utf-8") as f:
+        for c, paras in enumerate(bodies, start=1):
+            f.write(f"第{c}章 示例章节\n\n" + "\n\n".join(paras) + "\n\n")
+
+    html_path = os.path.join(directory, "sample.html")
+    with open(html_path, "w", encoding="utf-8") as f:
+        f.write("<html><head><title>Sample</title></head><body>\n")
+        for c, paras in enumerate(bodies, start=1):
+            f.write(f"<h2>第{c}章 示例章节</h2>\n")
+            f.write("".join(f"<p>{escape(p)}</p>\n" for p in paras))
+        f.write("</body></html>\n")
+
+    fb2_path = os.path.join(directory, "sample.fb2")
+    with open(fb2_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<FictionBook xmlns="http://www.gribuser.ru/xml/fictionbook/2.0">'
+                '<description><title-info><book-title>Sample</book-title></title-info></description><body>\n')
+        for c, paras in enumerate(bodies, start=1):
+            f.write(f"<section><title><p>第{c}章 示例章节</p></title>")
+            f.write("".join(f"<p>{escape(p)}</p>" for p in paras))
+            f.write("</section>\n")
+        f.write("</body></FictionBook>\n")
+
+    return [txt_path, html_path, fb2_path]
+
+def time_call(fn, runs: int):
+    """Run fn several times, return (median seconds, last result)"""
+    timings, result = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+def calibre_path(path: str, workdir: str):
+    # 复制到单独的子目录，避免生成的 .epub 覆盖或残留在原文件旁边(示例文件本身就在 workdir 中)
+    calibre_dir = os.path.join(workdir, "calibre")
+    os.makedirs(calibre_dir, exist_ok=True)
+    copy = os.path.join(calibre_dir, os.path.basename(path))
+    shutil.copyfile(path, copy)
+    return parse_epub(convert_to_epub(copy))
+
+def main():
+    parser = argparse.ArgumentParser(description='进程内解析与 Calibre 转换的耗时对比')
+    parser.add_argument('files', nargs='*', help='要测试的电子书文件 (默认生成示例文件)')
+    parser.add_argument('--chapters', type=int, default=50, help='示例文件的章节数 (默认: 50)')
+    parser.add_argument('--paragraphs', type=int, default=20, help='示例文件每章段落数 (默认: 20)')
+    parser.add_argument('--runs', '-n', type=int, default=3, help='每项重复次数 (默认: 3)')
+    args = parser.parse_args()
+
+    has_calibre = shutil.which("ebook-convert") is not None
+    if not has_calibre:
+        print("未找到 Calibre 的 ebook-convert，只测试进程内解析\n")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        files = args.files or generate_samples(workdir, args.chapters, args.paragraphs)
+        print(f"{'file':<24}{'size KB':>10}{'native s':>12}{'calibre s':>12}{'speedup':>10}{'chapters':>14}")
+        for path in files:
+            size_kb = os.path.getsize(path) / 1024
+            native_s, (_, native_chapters) = time_call(lambda: parse_book_file(path), args.runs)
+            if has_calibre:
+                calibre_s, (_, calibre_chapters) = time_call(lambda: calibre_path(path, workdir), args.runs)
+                print(f"{os.path.basename(path):<24}{size_kb:>10.1f}{native_s:>12.3f}{calibre_s:>12.3f}"
+                      f"{calibre_s / native_s:>9.1f}x{len(native_chapters):>7}/{len(calibre_chapters):<6}")
+            else:
+                print(f"{os.path.basename(path):<24}{size_kb:>10.1f}{native_s:>12.3f}{'-':>12}{'-':>10}"
+                      f"{len(native_chapters):>7}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+启动性能基准测试
+
+测量冷启动开销：
+  - 各模块的导入耗时 (每次在新的解释器进程中测量)
+  - `cli.py --help` 的总耗时
+  - 首个 TTS 请求与后续请求的延迟 (需要 Fish-Speech 服务器在运行)
+
+用法:
+    python bench_startup.py [--runs 10] [--skip-tts]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (名称, 在新进程中执行的参数)
+STARTUP_CASES = [
+    ("python (baseline)", ["-c", "pass"]),
+    ("import debug_log", ["-c", "import debug_log"]),
+    ("import parser", ["-c", "import parser"]),
+    ("import tts_fish", ["-c", "import tts_fish"]),
+    ("import cli", ["-c", "import cli"]),
+    ("cli.py --help", ["cli.py", "--help"]),
+    ("cli.py (missing file)", ["cli.py", "__missing__.epub"]),
+]
+
+def time_subprocess(args: list, runs: int) -> list:
+    """Run the interpreter with the given args several times, return wall times in ms"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=HERE,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def bench_startup(runs: int):
+    print(f"== 启动耗时 (每项 {runs} 次, 单位 ms) ==")
+    print(f"{'case':<26}{'min':>10}{'median':>10}{'max':>10}")
+    for name, args in STARTUP_CASES:
+        timings = time_subprocess(args, runs)
+        print(f"{name:<26}{min(timings):>10.1f}{statistics.median(timings):>10.1f}{max(timings):>10.1f}")
+
+def bench_first_request(runs: int):
+    print("\n== 首次请求延迟 (单位 ms) ==")
+    start = time.perf_counter()
+    from tts_fish import get_tts_client
+    client = get_tts_client()
+    init_ms = (time.perf_counter() - start) * 1000
+    print(f"{'import + client':<26}{init_ms:>10.1f}")
+
+    if not client.check_server():
+        print(f"TTS 服务器不可用 ({client.base_url})，跳过请求延迟测试")
+        return
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        client.synthesize("这是一个启动延迟测试。")
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{'first request':<26}{timings[0]:>10.1f}")
+    if len(timings) > 1:
+        print(f"{'warm request (median)':<26}{statistics.median(timings[1:]):>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='VoiceLibra 启动性能基准测试')
+    parser.add_argument('--runs', '-n', type=int, default=10, help='每项重复次数 (默认: 10)')
+    parser.add_argument('--skip-tts', action='store_true', help='跳过需要 TTS 服务器的测试')
+    args = parser.parse_args()
+
+    bench_startup(args.runs)
+    if not args.skip_tts:
+        bench_first_request(max(2, args.runs // 2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,12 @@
 import argparse
 import os
 import sys
-from parser import convert_to_epub, parse_epub
+import time
+from parser import convert_to_epub, parse_book_file, has_native_parser
 from tts_fish import synthesize_text
+from planner import plan_conversion, format_plan, record_throughput, count_requests, MODE_CLI
 from debug_log import log_message, log_error, log_file_status
+from profiling import JobProfiler, job_name
 
 def main():
     parser = argparse.ArgumentParser(description='VoiceLibra - 电子书转有声书工具')
@@ -16,6 +19,10 @@ def main():
     parser.add_argument('--format', '-f', default='mav', 
                        choices=['mp3', 'wav', 'pcm'],
                        help='输出格式 (默认: mav)')
+    parser.add_argument('--plan', action='store_true',
+                       help='只估算请求数、音频时长、磁盘占用和耗时，不调用TTS服务器')
+    parser.add_argument('--profile', action='store_true',
+                       help='分析解析与合成阶段的性能，在输出目录生成 .pstats 和 collapsed 火焰图文件')
     
     args = parser.parse_args()
     
@@ -31,14 +38,19 @@ def main():
     # 创建输出目录
     os.makedirs(args.output, exist_ok=True)
     
+    profiler = JobProfiler(args.output, job_name(os.path.splitext(os.path.basename(args.ebook))[0]),
+                           enabled=args.profile)
     try:
-        # 转换为EPUB格式
-        print(f"正在将 {args.ebook} 转换为EPUB格式...")
-        epub_path = convert_to_epub(args.ebook)
+        # 转换为EPUB格式 (EPUB/TXT/HTML/FB2 直接解析，无需 Calibre)
+        with profiler.phase("parse"):
+            book_path = args.ebook
+            if not has_native_parser(book_path):
+                print(f"正在将 {args.ebook} 转换为EPUB格式...")
+                book_path = convert_to_epub(args.ebook)
         
-        # 解析电子书内容
-        print("正在解析电子书内容...")
-        book_title, chapters = parse_epub(epub_path)
+            # 解析电子书内容
+            print("正在解析电子书内容...")
+            book_title, chapters = parse_book_file(book_path)
         
         # 确定章节范围
         total_chapters = len(chapters)
@@ -52,6 +64,12 @@ def main():
         end_chapter = min(end_chapter, total_chapters)
         selected_chapters = chapters[start_chapter-1:end_chapter]
         
+        if args.plan:
+            print(f"\n《{book_title}》转换预估 (章节 {start_chapter} - {end_chapter})\n")
+            print(format_plan(plan_conversion(chapters, start_chapter, end_chapter, args.format,
+                                              mode=MODE_CLI, intermediate_wav=False)))
+            return 0
+        
         print(f"\n开始处理《{book_title}》")
         print(f"章节范围: {start_chapter} - {end_chapter} (共 {total_chapters} 章)")
         print(f"声音克隆: {'启用 - ' + args.voice if args.voice else '未启用'}")
@@ -59,6 +77,8 @@ def main():
         print(f"输出目录: {os.path.abspath(args.output)}\n")
         
         # 处理每一章
+        done_chars = done_requests = 0
+        done_elapsed = 0.0
         for i, chapter in enumerate(selected_chapters, start=start_chapter):
             chapter_title = chapter['title'] or f"第{i}章"
             print(f"正在处理 {i}/{end_chapter}: {chapter_title}")
@@ -69,23 +89,32 @@ def main():
             
             try:
                 # 合成语音
-                audio_data = synthesize_text(
-                    text=chapter['text'],
-                    reference_audio_path=args.voice,
-                    output_format=args.format
-                )
+                chapter_started = time.time()
+                with profiler.phase("synthesis"):
+                    audio_data = synthesize_text(
+                        text=chapter['text'],
+                        reference_audio_path=args.voice,
+                        output_format=args.format
+                    )
                 
                 # 保存音频
                 with open(output_file, 'wb') as f:
                     f.write(audio_data)
                 
                 print(f"✓ 已保存: {os.path.basename(output_file)}")
+                # 只统计成功的章节，失败章节的耗时不计入吞吐量
+                done_elapsed += time.time() - chapter_started
+                done_chars += len(chapter['text'])
+                done_requests += count_requests(chapter['text'])[1]
                 
             except Exception as e:
                 log_error(f"处理章节 {i} 时出错: {str(e)}")
                 print(f"错误: 处理章节失败 - {str(e)}")
                 continue
         
+        # 记录本次吞吐量，供 --plan 估算耗时；性能分析有额外开销，不记录
+        if not profiler.enabled:
+            record_throughput(done_chars, done_requests, done_elapsed, mode=MODE_CLI)
         print(f"\n处理完成! 音频文件已保存到: {os.path.abspath(args.output)}")
         return 0
         
@@ -93,6 +122,9 @@ def main():
         log_error(f"程序执行出错: {str(e)}")
         print(f"错误: {str(e)}")
         return 1
+    finally:
+        for path in profiler.close():
+            print(f"性能分析: {path}")
 
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
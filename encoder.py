@@ -0,0 +1,335 @@
+import asyncio
+import io
+import os
+import wave
+from typing import List, Optional, Tuple
+
+from debug_log import log_message
+from planner import OUTPUT_BYTES_PER_SECOND, BYTES_PER_SECOND
+
+# 支持章节元数据的输出格式
+CHAPTER_FORMATS = ["m4b", "m4a", "mp4", "mov", "webm"]
+
+# WAV 采样宽度(字节) -> FFmpeg 原始 PCM 格式
+PCM_FORMATS = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}
+
+def codec_args(output_format: str) -> List[str]:
+    """FFmpeg codec arguments for an output format"""
+    fmt = output_format.lower()
+    if fmt in ["m4b", "m4a", "mp4", "mov"]:
+        # Use AAC codec for MP4/M4A/M4B
+        return ["-c:a", "aac", "-b:a", "128k"]
+    elif fmt == "mp3":
+        return ["-c:a", "libmp3lame", "-b:a", "192k"]
+    elif fmt == "flac":
+        return ["-c:a", "flac"]
+    elif fmt == "wav":
+        # PCM for WAV
+        return ["-c:a", "pcm_s16le"]
+    elif fmt == "aac":
+        # AAC ADTS format
+        return ["-c:a", "aac", "-b:a", "128k"]
+    # default to codec copy if unknown, though ideally never here
+    return ["-c", "copy"]
+
+def write_ffmetadata(path: str, title: str, chapters: List[Tuple[str, int, int]]):
+    """Write an FFMETADATA1 file, chapters = [(title, start_ms, end_ms), ...]"""
+    with open(path, "w", encoding="utf-8") as mf:
+        mf.write(";FFMETADATA1\n")
+        mf.write(f"title={title}\n")
+        mf.write("artist=FishSpeech TTS\n")
+        for idx, (chapter_title, start_ms, end_ms) in enumerate(chapters, start=1):
+            mf.write("[CHAPTER]\n")
+            mf.write("TIMEBASE=1/1000\n")
+            mf.write(f"START={start_ms}\n")
+            mf.write(f"END={end_ms}\n")
+            chapter_title = (chapter_title or f"Chapter {idx}").replace("\n", " ").strip()
+            mf.write(f"title={chapter_title}\n")
+
+def write_concat_list(path: str, files: List[str]):
+    """Write an FFmpeg concat demuxer list"""
+    with open(path, "w", encoding="utf-8") as lf:
+        for file in files:
+            # ffmpeg concat requires paths properly escaped/quoted
+            lf.write(f"file '{file}'\n")
+
+def concat_command(list_path: str, output_format: str, output_path: str,
+                   metadata_path: Optional[str] = None) -> List[str]:
+    """FFmpeg command encoding the files of a concat list into output_path"""
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if metadata_path:
+        cmd += ["-i", metadata_path, "-map_metadata", "1"]
+    return cmd + codec_args(output_format) + [output_path]
+
+async def run_ffmpeg(cmd: List[str]) -> Tuple[int, str]:
+    """Run an FFmpeg command without blocking the event loop, return (returncode, stderr)"""
+    log_message(f"FFmpeg command: {' '.join(cmd)}")
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.DEVNULL,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # 调用方被取消时结束 FFmpeg，不留下后台进程
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        raise
+    return process.returncode, stderr.decode("utf-8", errors="replace")
+
+async def run_ffmpeg_parallel(cmds: List[List[str]], max_workers: Optional[int] = None) -> Tuple[int, str]:
+    """
+    Run independent FFmpeg commands concurrently, at most max_workers (default: CPU count)
+    at a time. Returns (first non-zero returncode or 0, stderr of the failed commands).
+    """
+    semaphore = asyncio.Semaphore(max_workers or os.cpu_count() or 1)
+
+    async def run(cmd):
+        async with semaphore:
+            return await run_ffmpeg(cmd)
+
+    results = await asyncio.gather(*(run(cmd) for cmd in cmds))
+    failed = [(returncode, stderr) for returncode, stderr in results if returncode != 0]
+    if failed:
+        return failed[0][0], "\n".join(stderr for _, stderr in failed)
+    return 0, ""
+
+def part_limit_seconds(output_format: str, max_hours: float = 0, max_mb: float = 0) -> Optional[float]:
+    """Maximum duration of one part from a duration and/or size limit, None when not splitting"""
+    limits = []
+    if max_hours and max_hours > 0:
+        limits.append(max_hours * 3600)
+    if max_mb and max_mb > 0:
+        rate = OUTPUT_BYTES_PER_SECOND.get(output_format.lower(), BYTES_PER_SECOND)
+        limits.append(max_mb * 1024 * 1024 / rate)
+    return min(limits) if limits else None
+
+def split_parts(durations: List[float], max_seconds: Optional[float]) -> List[List[int]]:
+    """
+    Group consecutive chapters (by index) into parts of at most max_seconds.
+    Parts only break at chapter boundaries, so a chapter longer than the limit is a part of its own.
+    """
+    parts, current, current_seconds = [], [], 0.0
+    for index, seconds in enumerate(durations):
+        if current and max_seconds and current_seconds + seconds > max_seconds:
+            parts.append(current)
+            current, current_seconds = [], 0.0
+        current.append(index)
+        current_seconds += seconds
+    if current:
+        parts.append(current)
+    return parts
+
+def part_path(output_path: str, number: int) -> str:
+    """book.m4b -> book - Part 1.m4b"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root} - Part {number}{ext}"
+
+class PipeEncoder:
+    """
+    Long-lived FFmpeg process that encodes the book from raw PCM written to its stdin,
+    so no intermediate WAV files are written.
+
+    The process is started with the sample format of the first chapter. Chapter
+    boundaries are counted in sample frames; for formats with chapter support the
+    encoded stream is remuxed (stream copy) with the chapter metadata in finish().
+    output_path and title may still be changed before finish() (see ShardedEncoder).
+    """
+    def __init__(self, output_path: str, output_format: str, title: str, ffmpeg: str = "ffmpeg"):
+        self.output_path = output_path
+        self.output_format = output_format.lower()
+        self.title = title
+        self.ffmpeg = ffmpeg
+        self.chapters: List[Tuple[str, int, int]] = []  # (title, start_frame, end_frame)
+        self.frames = 0
+        self.params = None
+        self._process = None
+        self._stderr_task = None
+        self._completed = False  # finish() 已成功写出 output_path
+        if self.output_format in CHAPTER_FORMATS:
+            root, ext = os.path.splitext(output_path)
+            self._encode_path = f"{root}.encoding{ext}"
+        else:
+            self._encode_path = output_path
+
+    @property
+    def duration_seconds(self) -> float:
+        return self.frames / self.params[2] if self.params else 0.0
+
+    @property
+    def output_paths(self) -> List[str]:
+        return [self.output_path]
+
+    def chapter_marks_ms(self) -> List[Tuple[str, int, int]]:
+        """Chapter (title, start_ms, end_ms) computed from sample counts"""
+        rate = self.params[2] if self.params else 1
+        return [(title, start * 1000 // rate, max(start * 1000 // rate, end * 1000 // rate - 1))
+                for title, start, end in self.chapters]
+
+    async def _start(self, channels: int, sampwidth: int, rate: int):
+        if sampwidth not in PCM_FORMATS:
+            raise ValueError(f"不支持的采样宽度: {sampwidth} 字节")
+        self.params = (channels, sampwidth, rate)
+        cmd = [self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+               "-f", PCM_FORMATS[sampwidth], "-ar", str(rate), "-ac", str(channels), "-i", "pipe:0"]
+        cmd += codec_args(self.output_format) + [self._encode_path]
+        log_message(f"FFmpeg command: {' '.join(cmd)}")
+        self._process = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE,
+                                                             stdout=asyncio.subprocess.DEVNULL,
+                                                             stderr=asyncio.subprocess.PIPE)
+        # 持续读取 stderr，避免缓冲区写满后 FFmpeg 阻塞
+        self._stderr_task = asyncio.ensure_future(self._process.stderr.read())
+
+    async def _stderr(self) -> str:
+        if self._stderr_task is None:
+            return ""
+        return (await self._stderr_task).decode("utf-8", errors="replace")
+
+    async def add_chapter(self, title: str, wav_bytes: bytes) -> int:
+        """Append one chapter given as WAV bytes, return its length in frames"""
+        with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+            params = (w.getnchannels(), w.getsampwidth(), w.getframerate())
+            pcm = w.readframes(w.getnframes())
+        if self._process is None:
+            await self._start(*params)
+        elif params != self.params:
+            raise ValueError(f"章节音频格式 {params} 与之前的章节 {self.params} 不一致")
+
+        frames = len(pcm) // (params[0] * params[1])
+        try:
+            self._process.stdin.write(pcm)
+            await self._process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            await self._process.wait()
+            raise RuntimeError(f"FFmpeg 编码进程已退出: {await self._stderr()}")
+        self.chapters.append((title, self.frames, self.frames + frames))
+        self.frames += frames
+        return frames
+
+    async def finish(self) -> Tuple[int, str]:
+        """Close the stream and write the final file, return (returncode, stderr)"""
+        if self._process is None:
+            return 1, "没有可编码的音频"
+        self._process.stdin.close()
+        returncode = await self._process.wait()
+        stderr = await self._stderr()
+        if returncode != 0:
+            return returncode, stderr
+        if self.output_format not in CHAPTER_FORMATS:
+            if self._encode_path != self.output_path:
+                os.replace(self._encode_path, self.output_path)
+            self._completed = True
+            return returncode, stderr
+
+        # 编码后的音频直接复制，只写入章节元数据
+        metadata_path = f"{os.path.splitext(self.output_path)[0]}.chapters.txt"
+        write_ffmetadata(metadata_path, self.title, self.chapter_marks_ms())
+        try:
+            returncode, stderr = await run_ffmpeg([self.ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+                                                   "-i", self._encode_path, "-i", metadata_path,
+                                                   "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1",
+                                                   "-c", "copy", self.output_path])
+        finally:
+            for path in (self._encode_path, metadata_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._completed = returncode == 0
+        return returncode, stderr
+
+    async def abort(self):
+        """Stop the encoder and remove the partial output (no-op after a successful finish)"""
+        if self._completed or self._process is None:
+            return
+        if self._process.returncode is None:
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                pass
+            await self._process.wait()
+        if self._stderr_task is not None:
+            self._stderr_task.cancel()
+        for path in (self._encode_path, self.output_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        log_message(f"Stream encoding aborted: {self.output_path}")
+
+class ShardedEncoder:
+    """
+    Streams the book into parts of at most max_seconds, split at chapter boundaries.
+    Each part is a PipeEncoder with its own FFmpeg process and chapter metadata.
+    PCM only ever goes to the current part, so parts are encoded one after another;
+    only the finalization of a full part (the chapter remux) runs in the background
+    while the next one is being encoded.
+    A book that fits in one part is written to output_path without a part suffix.
+    """
+    def __init__(self, output_path: str, output_format: str, title: str, max_seconds: float,
+                 ffmpeg: str = "ffmpeg"):
+        self.output_path = output_path
+        self.output_format = output_format
+        self.title = title
+        self.max_seconds = max_seconds
+        self.ffmpeg = ffmpeg
+        self.parts: List[PipeEncoder] = []
+        self._finishing = []
+        self._completed = False
+
+    @property
+    def duration_seconds(self) -> float:
+        return sum(part.duration_seconds for part in self.parts)
+
+    @property
+    def output_paths(self) -> List[str]:
+        return [part.output_path for part in self.parts]
+
+    async def add_chapter(self, title: str, wav_bytes: bytes) -> int:
+        """Append one chapter, starting a new part when it would exceed max_seconds"""
+        with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+            seconds = w.getnframes() / w.getframerate()
+        current = self.parts[-1] if self.parts else None
+        if current is None or (current.frames and current.duration_seconds + seconds > self.max_seconds):
+            if current is not None:
+                if len(self.parts) == 1:
+                    # 需要分卷，第一部分改用带编号的文件名
+                    current.output_path = part_path(self.output_path, 1)
+                    current.title = f"{self.title} - Part 1"
+                self._finishing.append(asyncio.ensure_future(current.finish()))
+            number = len(self.parts) + 1
+            if number == 1:
+                self.parts.append(PipeEncoder(self.output_path, self.output_format, self.title, self.ffmpeg))
+            else:
+                self.parts.append(PipeEncoder(part_path(self.output_path, number), self.output_format,
+                                              f"{self.title} - Part {number}", self.ffmpeg))
+        return await self.parts[-1].add_chapter(title, wav_bytes)
+
+    async def finish(self) -> Tuple[int, str]:
+        """Finish all parts, return (first non-zero returncode or 0, stderr of the failed parts)"""
+        if not self.parts:
+            return 1, "没有可编码的音频"
+        self._finishing.append(asyncio.ensure_future(self.parts[-1].finish()))
+        results = await asyncio.gather(*self._finishing)
+        failed = [(returncode, stderr) for returncode, stderr in results if returncode != 0]
+        if failed:
+            return failed[0][0], "\n".join(stderr for _, stderr in failed)
+        self._completed = True
+        return 0, ""
+
+    async def abort(self):
+        """Stop all encoders and remove every part written so far (no-op after a successful finish)"""
+        if self._completed:
+            return
+        for task in self._finishing:
+            task.cancel()
+        # 等待被取消的收尾任务结束，其中的 FFmpeg 进程已被结束
+        await asyncio.gather(*self._finishing, return_exceptions=True)
+        for part in self.parts:
+            await part.abort()
+            # 已在后台完成的分卷也属于未完成的整书，一并删除
+            try:
+                os.remove(part.output_path)
+            except OSError:
+                pass
@@ -1,9 +1,11 @@
 import os
+import re
+import posixpath
 import subprocess
 import shutil
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
+import zipfile
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
 
 def should_skip_content(title: str, text: str) -> bool:
     """判断是否应该跳过这个内容"""
@@ -110,66 +112,55 @@ def convert_to_epub(input_path: str) -> str:
         raise RuntimeError(f"Conversion to EPUB failed: {e.stderr.decode('utf-8', errors='ignore')}")
     return output_path
 
-def parse_epub(epub_path: str):
+def _make_chapter(chapter_title, text: str, chapter_number: int):
     """
-    Parse the given EPUB file and extract chapters.
-    Returns a tuple (book_title, chapters) where chapters is a list of dict {title, text}.
+    Apply the skip rules and title fallbacks to one extracted document.
+    Returns a chapter dict {title, text}, or None if the document should be skipped.
     """
-    book = epub.read_epub(epub_path)
-    chapters = []
-    
-    # 获取书名
-    title = None
-    metadata_titles = book.get_metadata('DC', 'title')
-    if metadata_titles:
-        title = metadata_titles[0][0]
+    # 跳过内容检查
+    if should_skip_content(chapter_title, text):
+        return None
         
-    for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-        # 跳过导航文件
-        if "nav" in item.get_name().lower():
-            continue
-            
-        content = item.get_content()
-        if not content:
-            continue
-            
-        # 解析HTML
-        soup = BeautifulSoup(content, "html.parser")
-        for tag in soup(["script", "style"]):
-            tag.decompose()
-            
-        # 提取标题
-        chapter_title = None
-        header = soup.find(['h1', 'h2', 'h3', 'h4', 'h5'])
-        if header:
-            chapter_title = header.get_text().strip()
-            
-        # 提取正文
-        text = soup.get_text(separator="\n").strip()
+    # 如果没找到标题但有正文，尝试从正文开头提取
+    if not chapter_title and text:
+        lines = text.split('\n')
+        # 查找可能的标题行(短行)
+        for line in lines[:3]:  # 只检查前3行
+            line = line.strip()
+            if 10 < len(line) < 50:  # 标题通常是这个长度范围
+                chapter_title = line
+                text = '\n'.join(lines[lines.index(line)+1:])
+                break
+                
+    if not chapter_title:
+        chapter_title = f"Chapter {chapter_number}"
         
-        # 跳过内容检查
-        if should_skip_content(chapter_title, text):
-            continue
-            
-        # 如果没找到标题但有正文，尝试从正文开头提取
-        if not chapter_title and text:
-            lines = text.split('\n')
-            # 查找可能的标题行(短行)
-            for line in lines[:3]:  # 只检查前3行
-                line = line.strip()
-                if 10 < len(line) < 50:  # 标题通常是这个长度范围
-                    chapter_title = line
-                    text = '\n'.join(lines[lines.index(line)+1:])
-                    break
-                    
-        if not chapter_title:
-            chapter_title = f"Chapter {len(chapters) + 1}"
-            
-        chapters.append({
-            "title": chapter_title,
-            "text": text
-        })
+    return {
+        "title": chapter_title,
+        "text": text
+    }
+
+def _html_to_chapter(content, chapter_number: int):
+    """Extract a chapter from one HTML/XHTML document, or None if it should be skipped"""
+    from bs4 import BeautifulSoup
+
+    # 解析HTML
+    soup = BeautifulSoup(content, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.decompose()
         
+    # 提取标题
+    chapter_title = None
+    header = soup.find(['h1', 'h2', 'h3', 'h4', 'h5'])
+    if header:
+        chapter_title = header.get_text().strip()
+        
+    # 提取正文
+    text = soup.get_text(separator="\n").strip()
+    return _make_chapter(chapter_title, text, chapter_number)
+
+def _finalize_chapters(chapters: list) -> list:
+    """Split a book that came out as one huge chapter, then merge short chapters"""
     # 如果整本书被当作一个章节，尝试分割
     if len(chapters) == 1 and len(chapters[0]["text"]) > 5000:
         text = chapters[0]["text"]
@@ -192,6 +183,253 @@ def parse_epub(epub_path: str):
         chapters = new_chapters
         
     # 合并过短的章节
-    chapters = merge_short_chapters(chapters)
+    return merge_short_chapters(chapters)
+
+# EPUB 中需要提取文本的文档类型，图片、字体、样式表等资源不会被读取
+EPUB_DOCUMENT_TYPES = ("application/xhtml+xml", "text/html")
+CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NS = "{http://www.idpf.org/2007/opf}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+
+def read_epub_spine(zf):
+    """
+    Read the OPF package of an opened EPUB zip without loading any content.
+    Returns (book_title, document_names): the zip member names of the XHTML documents,
+    in spine (reading) order followed by documents that are only listed in the manifest.
+    """
+    container = ET.fromstring(zf.read("META-INF/container.xml"))
+    rootfile = container.find(f"{CONTAINER_NS}rootfiles/{CONTAINER_NS}rootfile")
+    opf_path = rootfile.get("full-path")
+    opf_dir = posixpath.dirname(opf_path)
+    package = ET.fromstring(zf.read(opf_path))
+
+    title = None
+    title_el = package.find(f"{OPF_NS}metadata/{DC_NS}title")
+    if title_el is not None and title_el.text:
+        title = title_el.text.strip()
+
+    documents = {}
+    for item in package.iterfind(f"{OPF_NS}manifest/{OPF_NS}item"):
+        if item.get("media-type") not in EPUB_DOCUMENT_TYPES:
+            continue
+        if "nav" in item.get("properties", "").split():
+            # EPUB3 导航文档(目录)，不是正文
+            continue
+        href = unquote(item.get("href", "").split("#", 1)[0])
+        documents[item.get("id")] = posixpath.normpath(posixpath.join(opf_dir, href))
+
+    names = []
+    for itemref in package.iterfind(f"{OPF_NS}spine/{OPF_NS}itemref"):
+        name = documents.pop(itemref.get("idref"), None)
+        if name:
+            names.append(name)
+    names.extend(documents.values())
+    return title, names
+
+def parse_epub(epub_path: str):
+    """
+    Parse the given EPUB file and extract chapters.
+    Returns a tuple (book_title, chapters) where chapters is a list of dict {title, text}.
+
+    Documents are read from the zip one at a time in spine order and dropped once
+    their text is extracted; images, fonts and other resources are never loaded,
+    so memory use does not grow with the size of the book's media.
+    """
+    chapters = []
+    with zipfile.ZipFile(epub_path) as zf:
+        try:
+            title, names = read_epub_spine(zf)
+        except (KeyError, AttributeError, ET.ParseError):
+            # OPF 缺失或格式异常，退回 ebooklib 的完整加载
+            return _parse_epub_ebooklib(epub_path)
+
+        for name in names:
+            # 跳过导航文件
+            if "nav" in name.lower():
+                continue
+            try:
+                content = zf.read(name)
+            except KeyError:
+                continue
+            if not content:
+                continue
+
+            chapter = _html_to_chapter(content, len(chapters) + 1)
+            del content
+            if chapter:
+                chapters.append(chapter)
+
+    return title, _finalize_chapters(chapters)
+
+def _parse_epub_ebooklib(epub_path: str):
+    """Fallback for EPUBs whose package document cannot be read directly"""
+    # 延迟导入，避免 CLI 在 --help 或参数错误时也加载 ebooklib/bs4
+    import ebooklib
+    from ebooklib import epub
+
+    book = epub.read_epub(epub_path)
+    chapters = []
     
-    return title, chapters
+    # 获取书名
+    title = None
+    metadata_titles = book.get_metadata('DC', 'title')
+    if metadata_titles:
+        title = metadata_titles[0][0]
+        
+    for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+        # 跳过导航文件
+        if "nav" in item.get_name().lower():
+            continue
+            
+        content = item.get_content()
+        if not content:
+            continue
+            
+        chapter = _html_to_chapter(content, len(chapters) + 1)
+        if chapter:
+            chapters.append(chapter)
+        
+    return title, _finalize_chapters(chapters)
+
+def _read_text(path: str) -> str:
+    """Read a text file, trying the encodings common for Chinese and English e-books"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    for encoding in ("utf-8-sig", "gb18030", "big5"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="ignore")
+
+# 纯文本中的章节标题行，如 "第十二章 xxx"、"Chapter 3"
+TXT_HEADING_RE = re.compile(
+    r"^[ \t\u3000]*("
+    r"第[0-9０-９零〇一二两三四五六七八九十百千万]+[章回节卷集部篇][^\n]{0,40}"
+    # 罗马数字只接受大写，且其后须为标点或行尾，避免把 "Part did ..." 之类的普通句子当作标题
+    r"|(?:chapter|part|book)[ \t]+(?:\d+\b|(?-i:[IVXLCDM]+)(?=[ \t]*(?:[.:：、,，\-—]|$)))[^\n]{0,60}"
+    r")[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+def parse_txt(txt_path: str):
+    """
+    Parse a plain text e-book in-process, without Calibre.
+    Chapters are split at heading lines such as "第一章" or "Chapter 1"; a book without
+    recognisable headings becomes a single chapter and is split by size like parse_epub does.
+    Returns (book_title, chapters) in the same format as parse_epub.
+    """
+    text = _read_text(txt_path).replace("\r\n", "\n").replace("\r", "\n")
+    title = os.path.splitext(os.path.basename(txt_path))[0]
+
+    # (标题, 正文) 列表，第一个标题之前的内容没有标题
+    sections = []
+    last_end, last_title = 0, None
+    for match in TXT_HEADING_RE.finditer(text):
+        sections.append((last_title, text[last_end:match.start()]))
+        last_title, last_end = match.group(1).strip(), match.end()
+    sections.append((last_title, text[last_end:]))
+
+    chapters = []
+    for chapter_title, body in sections:
+        chapter = _make_chapter(chapter_title, body.strip(), len(chapters) + 1)
+        if chapter:
+            chapters.append(chapter)
+    return title, _finalize_chapters(chapters)
+
+# Calibre 默认在 h1/h2 处分页，这里按同样的位置把单个 HTML 文件拆成多个文档
+HTML_SPLIT_RE = re.compile(r"<h[12][\s>]", re.IGNORECASE)
+HTML_TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+def parse_html(html_path: str):
+    """
+    Parse an HTML/XHTML e-book in-process, without Calibre.
+    The file is split into documents before each <h1>/<h2> and every document is
+    handled like one EPUB spine item. Returns (book_title, chapters) like parse_epub.
+    """
+    from bs4 import BeautifulSoup
+
+    html = _read_text(html_path)
+    title = None
+    title_match = HTML_TITLE_RE.search(html)
+    if title_match:
+        title = BeautifulSoup(title_match.group(1), "html.parser").get_text().strip() or None
+
+    positions = [m.start() for m in HTML_SPLIT_RE.finditer(html)]
+    bounds = [0] + positions + [len(html)]
+    chapters = []
+    for start, end in zip(bounds, bounds[1:]):
+        fragment = html[start:end]
+        if not fragment.strip():
+            continue
+        chapter = _html_to_chapter(fragment, len(chapters) + 1)
+        if chapter:
+            chapters.append(chapter)
+    return title, _finalize_chapters(chapters)
+
+def _fb2_text(element) -> str:
+    """Text of an FB2 element, one line per paragraph"""
+    lines = []
+    for node in element.iter():
+        tag = node.tag.rsplit('}', 1)[-1]
+        if tag in ("p", "v", "subtitle", "text-author"):
+            line = "".join(node.itertext()).strip()
+            if line:
+                lines.append(line)
+    return "\n".join(lines)
+
+def parse_fb2(fb2_path: str):
+    """
+    Parse a FictionBook 2 e-book in-process, without Calibre.
+    Each top-level <section> of the main body becomes one document.
+    Returns (book_title, chapters) like parse_epub.
+    """
+    root = ET.parse(fb2_path).getroot()
+    ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+
+    title = None
+    book_title = root.find(f"{ns}description/{ns}title-info/{ns}book-title")
+    if book_title is not None and book_title.text:
+        title = book_title.text.strip()
+
+    chapters = []
+    for body in root.findall(f"{ns}body"):
+        # 跳过注释、脚注等附加正文
+        if body.get("name") in ("notes", "comments", "footnotes"):
+            continue
+        sections = body.findall(f"{ns}section") or [body]
+        for section in sections:
+            chapter_title = None
+            title_el = section.find(f"{ns}title")
+            if title_el is not None:
+                chapter_title = _fb2_text(title_el).replace("\n", " ").strip() or None
+                section.remove(title_el)
+            chapter = _make_chapter(chapter_title, _fb2_text(section), len(chapters) + 1)
+            if chapter:
+                chapters.append(chapter)
+    return title, _finalize_chapters(chapters)
+
+# 可以直接在进程内解析、无需 Calibre 转换的格式
+NATIVE_PARSERS = {
+    ".epub": parse_epub,
+    ".txt": parse_txt,
+    ".html": parse_html,
+    ".htm": parse_html,
+    ".xhtml": parse_html,
+    ".fb2": parse_fb2,
+}
+
+def has_native_parser(input_path: str) -> bool:
+    """Whether the file can be parsed without converting it through Calibre"""
+    return os.path.splitext(input_path)[1].lower() in NATIVE_PARSERS
+
+def parse_book_file(input_path: str):
+    """
+    Parse any supported e-book into (book_title, chapters).
+    EPUB, TXT, HTML and FB2 are parsed in-process; other formats are converted
+    with Calibre's ebook-convert first and then parsed as EPUB.
+    """
+    native = NATIVE_PARSERS.get(os.path.splitext(input_path)[1].lower())
+    if native:
+        return native(input_path)
+    return parse_epub(convert_to_epub(input_path))
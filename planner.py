@@ -0,0 +1,185 @@
+import json
+import os
+import statistics
+import time
+from typing import List, Optional
+
+from tts_fish import split_into_sentences, LONG_TEXT_THRESHOLD, OUTPUT_DIR
+
+# 朗读速度估计(字符/秒)，有历史记录时以实测值为准
+CJK_CHARS_PER_SECOND = 4.5
+OTHER_CHARS_PER_SECOND = 14.0
+
+# Fish-Speech 输出 44.1kHz 16bit 单声道 WAV
+SAMPLE_RATE = 44100
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+# 各输出格式的码率(字节/秒)，用于估算最终文件大小
+OUTPUT_BYTES_PER_SECOND = {
+    "m4b": 128000 // 8,
+    "m4a": 128000 // 8,
+    "aac": 128000 // 8,
+    "mp3": 192000 // 8,
+    "flac": BYTES_PER_SECOND * 6 // 10,
+    "wav": BYTES_PER_SECOND,
+    "pcm": BYTES_PER_SECOND,
+}
+
+# 历史吞吐量记录，只保留最近的若干次
+THROUGHPUT_FILE = os.path.join(OUTPUT_DIR, "throughput.json")
+THROUGHPUT_HISTORY = 20
+
+# 运行方式：命令行逐章顺序合成，界面经调度器与其他会话并发合成，两者吞吐量不可比
+MODE_CLI = "cli"
+MODE_UI = "ui"
+
+def _is_cjk(char: str) -> bool:
+    return "\u3400" <= char <= "\u9fff" or "\uf900" <= char <= "\ufaff"
+
+def count_requests(text: str):
+    """
+    Return (sentences, requests) for one chapter, following synthesize_text:
+    long texts send one request per sentence, short texts a single request.
+    """
+    sentences = [s for s in split_into_sentences(text) if s.strip()]
+    if len(text) > LONG_TEXT_THRESHOLD:
+        return len(sentences), len(sentences)
+    return len(sentences), 1 if text.strip() else 0
+
+def estimate_audio_seconds(text: str, chars_per_audio_second: Optional[float] = None) -> float:
+    """Estimate spoken duration of text"""
+    if chars_per_audio_second:
+        return len(text) / chars_per_audio_second
+    cjk = sum(1 for c in text if _is_cjk(c))
+    other = sum(1 for c in text if not c.isspace() and not _is_cjk(c))
+    return cjk / CJK_CHARS_PER_SECOND + other / OTHER_CHARS_PER_SECOND
+
+def load_throughput(path: str = THROUGHPUT_FILE, mode: Optional[str] = None) -> dict:
+    """
+    Median throughput of earlier runs: chars synthesized per wall-clock second and,
+    when runs recorded their audio length, chars per second of audio.
+    With mode, the wall-clock rate only uses runs recorded in that mode.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            runs = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    result = {}
+    rates = [r["chars"] / r["elapsed"] for r in runs
+             if r.get("elapsed") and (mode is None or r.get("mode") == mode)]
+    if rates:
+        result["chars_per_second"] = statistics.median(rates)
+        result["runs"] = len(rates)
+    speech = [r["chars"] / r["audio_seconds"] for r in runs if r.get("audio_seconds")]
+    if speech:
+        result["chars_per_audio_second"] = statistics.median(speech)
+    return result
+
+def record_throughput(chars: int, requests: int, elapsed: float,
+                      audio_seconds: Optional[float] = None, path: str = THROUGHPUT_FILE,
+                      mode: Optional[str] = None):
+    """Append the measured throughput of a finished conversion to the history file"""
+    if chars <= 0 or elapsed <= 0:
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            runs = json.load(f)
+    except (OSError, ValueError):
+        runs = []
+    runs.append({
+        "time": int(time.time()),
+        "chars": chars,
+        "requests": requests,
+        "elapsed": round(elapsed, 3),
+        "audio_seconds": round(audio_seconds, 3) if audio_seconds else None,
+        "mode": mode,
+    })
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(runs[-THROUGHPUT_HISTORY:], f, ensure_ascii=False, indent=2)
+
+def plan_conversion(chapters: List[dict], start_chapter: int = 1, end_chapter: Optional[int] = None,
+                    output_format: str = "m4b", throughput_path: str = THROUGHPUT_FILE,
+                    mode: Optional[str] = None, intermediate_wav: bool = True) -> dict:
+    """
+    Dry-run a conversion of chapters[start_chapter-1:end_chapter] without contacting the server.
+    Returns per-chapter and total sentence/request counts, estimated audio duration,
+    intermediate WAV and final output size, and an ETA when earlier runs of the
+    same mode (MODE_CLI or MODE_UI) were recorded. intermediate_wav=False means no
+    temporary chapter WAV files are written (streaming encode, or the CLI saving
+    each chapter directly), so no intermediate disk space is needed.
+    """
+    end_chapter = end_chapter or len(chapters)
+    throughput = load_throughput(throughput_path, mode)
+    chars_per_audio_second = throughput.get("chars_per_audio_second")
+    output_rate = OUTPUT_BYTES_PER_SECOND.get(output_format.lower(), BYTES_PER_SECOND)
+
+    rows = []
+    for index in range(start_chapter, end_chapter + 1):
+        chapter = chapters[index - 1]
+        text = chapter["text"]
+        sentences, requests = count_requests(text)
+        audio_seconds = estimate_audio_seconds(text, chars_per_audio_second)
+        rows.append({
+            "index": index,
+            "title": chapter["title"],
+            "chars": len(text),
+            "sentences": sentences,
+            "requests": requests,
+            "audio_seconds": audio_seconds,
+            "wav_bytes": int(audio_seconds * BYTES_PER_SECOND),
+        })
+
+    total = {
+        key: sum(row[key] for row in rows)
+        for key in ("chars", "sentences", "requests", "audio_seconds", "wav_bytes")
+    }
+    total["output_bytes"] = int(total["audio_seconds"] * output_rate)
+    total["intermediate_bytes"] = total["wav_bytes"] if intermediate_wav else 0
+    eta_seconds = None
+    if throughput.get("chars_per_second"):
+        eta_seconds = total["chars"] / throughput["chars_per_second"]
+    return {
+        "chapters": rows,
+        "total": total,
+        "output_format": output_format,
+        "eta_seconds": eta_seconds,
+        "throughput": throughput,
+    }
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def _format_size(num_bytes: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def format_plan(plan: dict) -> str:
+    """Render a plan as a plain text report"""
+    lines = [f"{'#':>4}  {'字符':>8}{'句子':>7}{'请求':>7}{'时长':>10}{'WAV':>11}  标题"]
+    for row in plan["chapters"]:
+        lines.append(f"{row['index']:>4}  {row['chars']:>8}{row['sentences']:>7}{row['requests']:>7}"
+                     f"{_format_duration(row['audio_seconds']):>10}{_format_size(row['wav_bytes']):>11}  "
+                     f"{row['title'][:40]}")
+    total = plan["total"]
+    lines.append(f"{'合计':>4}  {total['chars']:>8}{total['sentences']:>7}{total['requests']:>7}"
+                 f"{_format_duration(total['audio_seconds']):>10}{_format_size(total['wav_bytes']):>11}")
+    lines.append("")
+    lines.append(f"预计音频时长: {_format_duration(total['audio_seconds'])}")
+    if total["intermediate_bytes"]:
+        lines.append(f"中间WAV文件: {_format_size(total['intermediate_bytes'])}")
+    else:
+        lines.append("中间WAV文件: 无 (不写临时文件)")
+    lines.append(f"最终{plan['output_format']}文件: 约 {_format_size(total['output_bytes'])}")
+    if plan["eta_seconds"] is not None:
+        throughput = plan["throughput"]
+        lines.append(f"预计耗时: {_format_duration(plan['eta_seconds'])} "
+                     f"(基于最近 {throughput['runs']} 次运行, {throughput['chars_per_second']:.1f} 字符/秒)")
+    else:
+        lines.append("预计耗时: 暂无历史吞吐量记录，完成一次转换后即可估算")
+    return "\n".join(lines)
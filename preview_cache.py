@@ -0,0 +1,122 @@
+import asyncio
+import contextlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from scheduler import TTSScheduler, get_scheduler, PRIORITY_BACKGROUND
+from tts_async import async_synthesize_text
+
+class _Entry:
+    def __init__(self, user: str):
+        self.user = user
+        self.task: Optional[asyncio.Future] = None
+        self.started = False  # 是否已从调度器获得槽位(请求已发往服务器)
+
+class PreviewPrefetcher:
+    """
+    Speculatively synthesizes chapter previews at background priority and keeps
+    the results in a bounded LRU cache keyed by (text, reference audio).
+
+    A prefetch that is still queued when the user asks for it is cancelled so the
+    caller can synthesize at interactive priority instead of waiting behind bulk
+    jobs; one that is already on the server is awaited.
+    """
+    def __init__(self, scheduler: TTSScheduler, max_entries: int = 64):
+        self.scheduler = scheduler
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+
+    @staticmethod
+    def _key(text: str, reference_audio_path: Optional[str]) -> Tuple[str, str]:
+        return text, reference_audio_path or ""
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.task is not None and not entry.task.done():
+            entry.task.cancel()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def _tracking_slot(self, entry: _Entry):
+        @contextlib.asynccontextmanager
+        async def slot():
+            async with self.scheduler.slot(PRIORITY_BACKGROUND, entry.user):
+                entry.started = True
+                yield
+        return slot
+
+    async def _synthesize(self, key, entry: _Entry, text: str, reference_audio_path: Optional[str]) -> bytes:
+        try:
+            return await async_synthesize_text(text, reference_audio_path, slot=self._tracking_slot(entry))
+        except Exception:
+            # 预合成失败不影响用户，点击试听时会重新合成
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            raise
+
+    def prefetch(self, text: str, reference_audio_path: Optional[str] = None, user: str = None):
+        """Start background synthesis of text unless it is already cached or in flight"""
+        if not text:
+            return
+        key = self._key(text, reference_audio_path)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        entry = _Entry(user or "")
+        entry.task = asyncio.ensure_future(self._synthesize(key, entry, text, reference_audio_path))
+        # 避免 "Task exception was never retrieved" 警告
+        entry.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._entries[key] = entry
+        self._evict()
+
+    def put(self, text: str, reference_audio_path: Optional[str], audio: bytes, user: str = None):
+        """Cache audio synthesized elsewhere (e.g. by an interactive preview)"""
+        key = self._key(text, reference_audio_path)
+        self._discard(key)
+        entry = _Entry(user or "")
+        entry.task = asyncio.get_running_loop().create_future()
+        entry.task.set_result(audio)
+        entry.started = True
+        self._entries[key] = entry
+        self._evict()
+
+    async def get(self, text: str, reference_audio_path: Optional[str] = None) -> Optional[bytes]:
+        """
+        Return cached audio for text, waiting for a prefetch that is already being
+        synthesized. Returns None if the caller should synthesize it itself.
+        """
+        key = self._key(text, reference_audio_path)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        if not entry.task.done() and not entry.started:
+            # 仍在后台排队，取消后由调用方以交互优先级合成
+            self._discard(key)
+            return None
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if entry.task.cancelled():
+                return None
+            raise
+        except Exception:
+            return None
+
+    def cancel_pending(self, user: str):
+        """Drop this user's prefetches that have not reached the server yet"""
+        for key, entry in list(self._entries.items()):
+            if entry.user == (user or "") and not entry.task.done() and not entry.started:
+                self._discard(key)
+
+_prefetcher: Optional[PreviewPrefetcher] = None
+
+def get_preview_prefetcher() -> PreviewPrefetcher:
+    """Return the process-wide preview prefetcher"""
+    global _prefetcher
+    if _prefetcher is None:
+        scheduler = get_scheduler()
+        _prefetcher = PreviewPrefetcher(scheduler, max_entries=scheduler.client.config["preview_cache_size"])
+    return _prefetcher
@@ -0,0 +1,138 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List
+
+from debug_log import log_message, log_error
+
+# 关闭时 phase() 返回的共享空上下文，不产生任何额外开销
+_DISABLED = contextlib.nullcontext()
+
+# cProfile 在进程内只能有一个生效(3.11 及以前第二个会静默替换第一个的钩子)，
+# 同一时间只允许一个阶段持有，其他并发阶段只做采样
+_cprofile_lock = threading.Lock()
+_cprofile_owner = None
+
+class JobProfiler:
+    """
+    Per-job profiling of named phases (parse / synthesis / merge).
+
+    When enabled, each phase runs under cProfile and a sampling thread that records
+    the call stacks of the thread that entered the phase; entering the same phase
+    again (e.g. once per chapter) accumulates. close() writes the artifacts to
+    output_dir: one `<job>.<phase>.pstats` per phase and a `<job>.collapsed.txt`
+    with collapsed stacks (flamegraph.pl / speedscope format). When disabled,
+    phase() returns a shared no-op context manager.
+
+    Only one phase in the process runs under cProfile at a time; phases of
+    concurrent jobs that start meanwhile are only sampled. Both cProfile and the
+    sampler observe a whole thread: a phase that stays open across `await`s on a
+    shared event loop (as in the UI) also counts whatever other sessions' handlers
+    run on that loop in the meantime.
+    """
+    def __init__(self, output_dir: str, job_name: str, enabled: bool = False, interval: float = 0.005):
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.job_name = job_name
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.profiles = {}
+        self.artifacts: List[str] = []
+
+    def phase(self, name: str):
+        """Context manager profiling one phase of the job"""
+        if not self.enabled:
+            return _DISABLED
+        return self._profile_phase(name)
+
+    @contextlib.contextmanager
+    def _profile_phase(self, name: str):
+        import cProfile
+
+        global _cprofile_owner
+        token = object()
+        profile = None
+        with _cprofile_lock:
+            if _cprofile_owner is None:
+                profile = self.profiles.get(name) or cProfile.Profile()
+                try:
+                    profile.enable()
+                    _cprofile_owner = token
+                except ValueError:
+                    # 其他工具(如调试器)已占用分析钩子，只做采样
+                    profile = None
+        sampler = _StackSampler(threading.get_ident(), name, self.interval)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            self.samples.update(sampler.samples)
+            if profile is not None:
+                with _cprofile_lock:
+                    profile.disable()
+                    _cprofile_owner = None
+                self.profiles[name] = profile
+
+    def _write_pstats(self, profile, phase: str):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"{self.job_name}.{phase}.pstats")
+            profile.dump_stats(path)
+            self.artifacts.append(path)
+        except Exception as e:
+            log_error(f"Failed to write profile for phase {phase}: {str(e)}", e)
+
+    def close(self) -> List[str]:
+        """Write the pstats and collapsed-stack files and return the paths of all artifacts"""
+        for phase, profile in self.profiles.items():
+            self._write_pstats(profile, phase)
+        self.profiles = {}
+        if self.enabled and self.samples:
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                path = os.path.join(self.output_dir, f"{self.job_name}.collapsed.txt")
+                with open(path, "w", encoding="utf-8") as f:
+                    for stack, count in sorted(self.samples.items()):
+                        f.write(f"{stack} {count}\n")
+                self.artifacts.append(path)
+            except Exception as e:
+                log_error(f"Failed to write collapsed stacks: {str(e)}", e)
+        if self.artifacts:
+            log_message(f"Profile artifacts: {', '.join(self.artifacts)}")
+        return self.artifacts
+
+class _StackSampler(threading.Thread):
+    """Samples the stack of one thread at a fixed interval into collapsed-stack counts"""
+    def __init__(self, thread_id: int, root: str, interval: float):
+        super().__init__(name=f"profiler-{root}", daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(self.root)
+            self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def job_name(prefix: str) -> str:
+    """Unique artifact prefix for a job, e.g. profile_mybook_20240101-120000"""
+    safe = "".join(c if c.isalnum() else "_" for c in prefix)[:40]
+    return f"profile_{safe}_{time.strftime('%Y%m%d-%H%M%S')}"
@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import functools
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+from tts_async import AsyncTTSClient, get_async_tts_client
+
+# 优先级：数值越小越先调度
+PRIORITY_INTERACTIVE = 0   # 界面上的试听(测试克隆声音/测试章节合成)
+PRIORITY_BULK = 10         # 整本书转换
+PRIORITY_BACKGROUND = 20   # 推测性的后台预合成
+
+class TTSScheduler:
+    """
+    Prioritized admission control in front of an AsyncTTSClient.
+
+    At most `slots` requests are sent to the Fish-Speech server at once.
+    Waiting requests are served lowest priority value first; within one
+    priority, users are served round-robin so concurrent bulk jobs share the
+    server fairly. Non-interactive requests never use the last
+    `reserved_interactive` slots, so a preview only ever waits for one sentence.
+    Each user may hold at most `per_user_limit` of them while other users are
+    waiting; when only over-limit users are waiting they may exceed it, so no
+    slot is left idle. Hedge duplicates (see AsyncTTSClient._post) of a request
+    that is already in flight are served before other waiters of their priority
+    and are not subject to the per-user limit.
+    """
+    def __init__(self,
+                 client: AsyncTTSClient,
+                 slots: int = 4,
+                 reserved_interactive: int = 1,
+                 per_user_limit: Optional[int] = 2):
+        self.client = client
+        self.slots = max(1, slots)
+        self.reserved_interactive = max(0, min(reserved_interactive, self.slots - 1))
+        self.per_user_limit = per_user_limit
+        # priority -> OrderedDict(user -> deque of waiting futures)，OrderedDict 的顺序即轮转顺序
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+        # priority -> deque of (user, future)，对冲副本，先于普通等待者调度
+        self._hedges: Dict[int, deque] = {}
+        self._in_flight = 0
+        self._in_flight_bulk = 0
+        self._user_in_flight: Dict[str, int] = {}
+
+    def _user_can_run(self, priority: int, user: str, capped: bool = True) -> bool:
+        if priority <= PRIORITY_INTERACTIVE:
+            return True
+        if self._in_flight_bulk >= self.slots - self.reserved_interactive:
+            return False
+        return not capped or self.per_user_limit is None or self._user_in_flight.get(user, 0) < self.per_user_limit
+
+    def _grant(self, priority: int, user: str):
+        self._in_flight += 1
+        if priority > PRIORITY_INTERACTIVE:
+            self._in_flight_bulk += 1
+            self._user_in_flight[user] = self._user_in_flight.get(user, 0) + 1
+
+    def _release(self, priority: int, user: str):
+        self._in_flight -= 1
+        if priority > PRIORITY_INTERACTIVE:
+            self._in_flight_bulk -= 1
+            self._user_in_flight[user] -= 1
+            if not self._user_in_flight[user]:
+                del self._user_in_flight[user]
+        self._dispatch()
+
+    def _next_waiter(self):
+        """Pop the next waiter that may run now, or return None"""
+        for priority in sorted(set(self._queues) | set(self._hedges)):
+            hedges = self._hedges.get(priority)
+            if hedges is not None:
+                while hedges and hedges[0][1].done():
+                    hedges.popleft()
+                if hedges and self._user_can_run(priority, hedges[0][0], capped=False):
+                    user, fut = hedges.popleft()
+                    if not hedges:
+                        del self._hedges[priority]
+                    return priority, user, fut
+                if not hedges:
+                    del self._hedges[priority]
+            users = self._queues.get(priority)
+            if users is None:
+                continue
+            # 先遵守每用户上限；只剩超出上限的用户在等待时也分配，避免槽位空闲
+            for capped in (True, False):
+                for user in list(users):
+                    waiters = users[user]
+                    # 丢弃已取消的等待者
+                    while waiters and waiters[0].done():
+                        waiters.popleft()
+                    if not waiters:
+                        del users[user]
+                        continue
+                    if not self._user_can_run(priority, user, capped):
+                        continue
+                    fut = waiters.popleft()
+                    # 轮转：刚被服务的用户排到队尾
+                    users.move_to_end(user)
+                    if not waiters:
+                        del users[user]
+                    return priority, user, fut
+            if not users:
+                del self._queues[priority]
+        return None
+
+    def _dispatch(self):
+        while self._in_flight < self.slots:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            priority, user, fut = waiter
+            self._grant(priority, user)
+            fut.set_result(None)
+
+    async def acquire(self, priority: int = PRIORITY_BULK, user: str = None, hedge: bool = False):
+        """Wait until a server slot is granted to this request (hedge: a duplicate of one in flight)"""
+        user = user or ""
+        fut = asyncio.get_running_loop().create_future()
+        if hedge:
+            self._hedges.setdefault(priority, deque()).append((user, fut))
+        else:
+            self._queues.setdefault(priority, OrderedDict()).setdefault(user, deque()).append(fut)
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 已分配到槽位但调用方同时被取消，需要归还
+            if fut.done() and not fut.cancelled():
+                self._release(priority, user)
+            raise
+
+    def release(self, priority: int = PRIORITY_BULK, user: str = None):
+        self._release(priority, user or "")
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_BULK, user: str = None, hedge: bool = False):
+        """Hold one server slot for the duration of the block"""
+        await self.acquire(priority, user, hedge)
+        try:
+            yield
+        finally:
+            self.release(priority, user)
+
+    def slot_factory(self, priority: int = PRIORITY_BULK, user: str = None):
+        """
+        Return a zero-argument callable for the `slot` parameter of AsyncTTSClient methods.
+        Its `hedge` attribute is the variant used for hedge duplicates.
+        """
+        factory = functools.partial(self.slot, priority, user)
+        factory.hedge = functools.partial(self.slot, priority, user, True)
+        return factory
+
+    def stats(self) -> dict:
+        """当前在途请求与排队情况"""
+        return {
+            "in_flight": self._in_flight,
+            "in_flight_bulk": self._in_flight_bulk,
+            "waiting": {
+                priority: sum(len(w) for w in self._queues.get(priority, {}).values())
+                + len(self._hedges.get(priority, ()))
+                for priority in set(self._queues) | set(self._hedges)
+            },
+        }
+
+    async def synthesize(self, text: str, priority: int = PRIORITY_BULK, user: str = None, **kwargs) -> bytes:
+        """AsyncTTSClient.synthesize, admitted through the scheduler"""
+        return await self.client.synthesize(text, slot=self.slot_factory(priority, user), **kwargs)
+
+    async def synthesize_long_text(self, text: str, priority: int = PRIORITY_BULK, user: str = None, **kwargs):
+        """AsyncTTSClient.synthesize_long_text, each sentence admitted through the scheduler"""
+        return await self.client.synthesize_long_text(text, slot=self.slot_factory(priority, user), **kwargs)
+
+_scheduler: Optional[TTSScheduler] = None
+
+def get_scheduler() -> TTSScheduler:
+    """Return the process-wide scheduler around the shared AsyncTTSClient"""
+    global _scheduler
+    if _scheduler is None:
+        client = get_async_tts_client()
+        _scheduler = TTSScheduler(
+            client,
+            slots=client.config["scheduler_slots"],
+            reserved_interactive=client.config["scheduler_reserved_interactive"],
+            per_user_limit=client.config["scheduler_per_user_limit"],
+        )
+    return _scheduler
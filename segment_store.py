@@ -0,0 +1,140 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from debug_log import log_message
+
+# 索引记录: chapter, sentence, tag, offset, length (小端，每条 24 字节)
+INDEX_RECORD = struct.Struct("<IIIQI")
+
+def segment_tag(text: str, voice: bytes = b"") -> int:
+    """Checksum of the text and voice a segment was synthesized from, used to reject stale entries"""
+    return zlib.crc32(text.encode("utf-8"), zlib.crc32(voice))
+
+class SegmentStore:
+    """
+    Packed, append-only store of audio segments for one book.
+
+    <name>.seg holds the audio back to back and <name>.idx one fixed-size record
+    (chapter, sentence, tag, offset, length) per segment. Data is written before
+    its index record, so a crash can only leave unindexed bytes at the end; a torn
+    last record is ignored. Writing a key again appends a new copy and the latest
+    record wins. Reads are slices of a memory map of the data file.
+    """
+    def __init__(self, directory: str, name: str):
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, f"{name}.seg")
+        self.index_path = os.path.join(directory, f"{name}.idx")
+        self._lock = threading.Lock()
+        self._index: Dict[Tuple[int, int], Tuple[int, int, int]] = {}
+        self._data = open(self.data_path, "a+b")
+        self._index_file = open(self.index_path, "a+b")
+        self._map = None
+        self.hits = 0  # get() 命中次数，用于判断本次结果是否来自缓存
+        self._load_index()
+
+    def _load_index(self):
+        data_size = os.path.getsize(self.data_path)
+        index_size = os.path.getsize(self.index_path)
+        usable = index_size - index_size % INDEX_RECORD.size
+        if usable:
+            with mmap.mmap(self._index_file.fileno(), usable, access=mmap.ACCESS_READ) as index_map:
+                for chapter, sentence, tag, offset, length in INDEX_RECORD.iter_unpack(index_map):
+                    if offset + length <= data_size:
+                        self._index[(chapter, sentence)] = (tag, offset, length)
+        if usable != index_size:
+            log_message(f"Ignoring torn index record in {self.index_path}")
+            self._index_file.truncate(usable)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self._index
+
+    def put(self, chapter: int, sentence: int, audio: bytes, tag: int = 0):
+        """Append a segment"""
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(audio)
+            self._data.flush()
+            self._index_file.write(INDEX_RECORD.pack(chapter, sentence, tag, offset, len(audio)))
+            self._index_file.flush()
+            self._index[(chapter, sentence)] = (tag, offset, len(audio))
+
+    def has(self, chapter: int, sentence: int, tag: Optional[int] = None) -> bool:
+        """Whether a segment is stored (with the given tag)"""
+        entry = self._index.get((chapter, sentence))
+        return entry is not None and (tag is None or entry[0] == tag)
+
+    def get(self, chapter: int, sentence: int, tag: Optional[int] = None) -> Optional[bytes]:
+        """Return a segment, or None if it is missing or was stored with a different tag"""
+        if not self.has(chapter, sentence, tag):
+            return None
+        _, offset, length = self._index[(chapter, sentence)]
+        if length == 0:
+            self.hits += 1
+            return b""
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                # 数据文件在映射之后又有追加，重新映射
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            self.hits += 1
+            return self._map[offset:offset + length]
+
+    def sentences(self, chapter: int) -> List[int]:
+        """Sorted sentence indices stored for a chapter"""
+        return sorted(sentence for ch, sentence in self._index if ch == chapter)
+
+    def chapter_segments(self, chapter: int) -> List[bytes]:
+        """All segments of a chapter in sentence order"""
+        return [self.get(chapter, sentence) for sentence in self.sentences(chapter)]
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._data.close()
+            self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+_stores: Dict[str, SegmentStore] = {}
+_stores_lock = threading.Lock()
+
+def get_segment_store(directory: str, name: str) -> SegmentStore:
+    """
+    Return the shared store for a book, opening it on first use.
+    All writers in a process go through one instance so appends do not interleave.
+    """
+    key = os.path.abspath(os.path.join(directory, name))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = SegmentStore(directory, name)
+            _stores[key] = store
+    return store
+
+def discard_segment_store(store: SegmentStore):
+    """Close a store, forget the shared instance and delete its files"""
+    with _stores_lock:
+        for key, value in list(_stores.items()):
+            if value is store:
+                del _stores[key]
+    store.close()
+    for path in (store.data_path, store.index_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
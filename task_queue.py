@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+"""
+分布式合成：基于 SQLite 的本地持久化任务队列
+
+协调者把一本书拆成句子级任务写入队列数据库，任意数量的 worker 进程(可在不同机器上，
+共享同一个数据库文件)领取任务、合成并回报结果；租约过期的任务会被重新领取，失败的任务
+按次数重试。全部完成后由 assemble 步骤按章节拼接音频。
+
+用法:
+    python task_queue.py enqueue book.epub --db queue.sqlite [--voice ref.wav]
+    python task_queue.py work --db queue.sqlite          # 可在多台机器上同时运行
+    python task_queue.py status --db queue.sqlite
+    python task_queue.py assemble --db queue.sqlite --output output
+
+注意：共享文件系统上的 SQLite 依赖文件锁，NFS 等需要开启锁支持；数据库不使用 WAL 模式。
+"""
+import argparse
+import hashlib
+import os
+import socket
+import sqlite3
+import sys
+import subprocess
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+from debug_log import log_message, log_error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id TEXT PRIMARY KEY,
+    title TEXT,
+    reference_audio BLOB,
+    reference_text TEXT,
+    output_format TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    book_id TEXT NOT NULL,
+    chapter_index INTEGER NOT NULL,
+    title TEXT,
+    PRIMARY KEY (book_id, chapter_index)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id TEXT NOT NULL,
+    chapter_index INTEGER NOT NULL,
+    sentence_index INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    audio BLOB,
+    UNIQUE (book_id, chapter_index, sentence_index)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+CREATE INDEX IF NOT EXISTS tasks_next ON tasks (status, book_id, chapter_index, sentence_index);
+"""
+
+# 任务状态
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+class TaskQueue:
+    """
+    Durable sentence task queue in a SQLite file.
+    Every state change runs in its own IMMEDIATE transaction, so any number of
+    processes can share the database; a lease only counts while it has not expired.
+    """
+    def __init__(self, db_path: str, max_attempts: int = 3, timeout: float = 60):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def enqueue_book(self, book_id: str, title: str, chapters: List[dict],
+                     sentences_per_chapter: List[List[str]], output_format: str = "wav",
+                     reference_audio: Optional[bytes] = None, reference_text: Optional[str] = None,
+                     first_chapter_index: int = 1) -> int:
+        """
+        Write one task per sentence. Chapters are numbered from first_chapter_index.
+        Re-enqueueing the same book_id keeps existing results but updates the
+        title and output format, which only take effect in assemble.
+        """
+        count = 0
+        with self._transaction():
+            self.conn.execute(
+                "INSERT INTO books (book_id, title, reference_audio, reference_text, output_format, created) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (book_id) DO UPDATE SET title = excluded.title, output_format = excluded.output_format",
+                (book_id, title, reference_audio, reference_text, output_format, time.time()))
+            for chapter_index, (chapter, sentences) in enumerate(zip(chapters, sentences_per_chapter),
+                                                                start=first_chapter_index):
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO chapters (book_id, chapter_index, title) VALUES (?, ?, ?)",
+                    (book_id, chapter_index, chapter["title"]))
+                for sentence_index, sentence in enumerate(sentences):
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO tasks (book_id, chapter_index, sentence_index, text) VALUES (?, ?, ?, ?)",
+                        (book_id, chapter_index, sentence_index, sentence))
+                    count += cursor.rowcount
+        return count
+
+    def lease(self, worker_id: str, lease_seconds: float = 300, book_id: Optional[str] = None) -> Optional[sqlite3.Row]:
+        """Claim the next pending (or lease-expired) task for worker_id, or return None"""
+        now = time.time()
+        with self._transaction():
+            # 租约过期且已用完重试次数的任务直接标记为失败
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, error = 'lease expired', lease_owner = NULL "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts))
+            # 等待中与租约过期的任务分别查询，都只走 tasks_next 索引中对应状态的一段，
+            # 不会扫描已完成的任务
+            book_filter = " AND book_id = ?" if book_id else ""
+            book_param = (book_id,) if book_id else ()
+            order = " ORDER BY book_id, chapter_index, sentence_index LIMIT 1"
+            candidates = [
+                self.conn.execute("SELECT * FROM tasks WHERE status = ?" + book_filter + order,
+                                  (PENDING,) + book_param).fetchone(),
+                self.conn.execute("SELECT * FROM tasks WHERE status = ? AND lease_expires < ?" + book_filter + order,
+                                  (LEASED, now) + book_param).fetchone(),
+            ]
+            candidates = [c for c in candidates if c is not None]
+            if not candidates:
+                return None
+            row = min(candidates, key=lambda c: (c["book_id"], c["chapter_index"], c["sentence_index"]))
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (LEASED, worker_id, now + lease_seconds, row["id"]))
+        return row
+
+    def extend(self, task_id: int, worker_id: str, lease_seconds: float = 300) -> bool:
+        """Extend a lease that worker_id still holds"""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (time.time() + lease_seconds, task_id, LEASED, worker_id))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, audio: bytes) -> bool:
+        """Store the result. Returns False if the lease was lost to another worker."""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET status = ?, audio = ?, error = NULL, lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (DONE, audio, task_id, LEASED, worker_id))
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: int, worker_id: str, error: str) -> bool:
+        """Release a failed task for retry, or mark it failed once max_attempts is reached"""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "error = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (self.max_attempts, FAILED, PENDING, error, task_id, LEASED, worker_id))
+        return cursor.rowcount == 1
+
+    def book(self, book_id: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM books WHERE book_id = ?", (book_id,)).fetchone()
+
+    def books(self) -> List[sqlite3.Row]:
+        return self.conn.execute("SELECT book_id, title, output_format FROM books ORDER BY created").fetchall()
+
+    def status(self, book_id: Optional[str] = None) -> dict:
+        """Task counts by status"""
+        query = "SELECT status, COUNT(*) AS n FROM tasks" + (" WHERE book_id = ?" if book_id else "") + " GROUP BY status"
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for row in self.conn.execute(query, (book_id,) if book_id else ()):
+            counts[row["status"]] = row["n"]
+        return counts
+
+    def chapters(self, book_id: str) -> List[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT chapter_index, title FROM chapters WHERE book_id = ? ORDER BY chapter_index", (book_id,)).fetchall()
+
+    def chapter_results(self, book_id: str, chapter_index: int) -> List[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT sentence_index, status, audio, error FROM tasks "
+            "WHERE book_id = ? AND chapter_index = ? ORDER BY sentence_index",
+            (book_id, chapter_index)).fetchall()
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK, taking the write lock up front"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+class _LeaseHeartbeat(threading.Thread):
+    """
+    Keeps extending a task's lease while the worker is synthesizing it, so a slow
+    request is not re-leased to another worker. Uses its own connection because
+    SQLite connections are bound to the thread that created them.
+    """
+    def __init__(self, db_path: str, task_id: int, worker_id: str, lease_seconds: float):
+        super().__init__(name=f"lease-{task_id}", daemon=True)
+        self.db_path = db_path
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._stop_event = threading.Event()
+
+    def run(self):
+        queue = TaskQueue(self.db_path)
+        try:
+            while not self._stop_event.wait(self.lease_seconds / 3):
+                if not queue.extend(self.task_id, self.worker_id, self.lease_seconds):
+                    break
+        except sqlite3.Error as e:
+            log_error(f"Failed to extend lease on task {self.task_id}: {str(e)}")
+        finally:
+            queue.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _book_id(ebook_path: str, voice_path: Optional[str]) -> str:
+    digest = hashlib.sha1()
+    for path in (ebook_path, voice_path):
+        if path:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()[:16]
+
+def enqueue(args) -> int:
+    from parser import convert_to_epub, parse_book_file, has_native_parser
+    from tts_fish import split_into_sentences
+
+    book_path = args.ebook if has_native_parser(args.ebook) else convert_to_epub(args.ebook)
+    book_title, chapters = parse_book_file(book_path)
+    start = max(1, args.start)
+    end = min(args.end or len(chapters), len(chapters))
+    selected = chapters[start - 1:end]
+    if not selected:
+        print(f"错误: 无效的章节范围。本书共有 {len(chapters)} 章。")
+        return 1
+
+    reference_audio = None
+    if args.voice:
+        with open(args.voice, "rb") as f:
+            reference_audio = f.read()
+
+    book_id = _book_id(args.ebook, args.voice)
+    sentences = [[s for s in split_into_sentences(ch["text"]) if s.strip()] for ch in selected]
+    queue = TaskQueue(args.db, max_attempts=args.max_attempts)
+    added = queue.enqueue_book(book_id, book_title or os.path.basename(args.ebook), selected, sentences,
+                               args.format, reference_audio, args.voice_text, first_chapter_index=start)
+    queue.close()
+    print(f"已加入队列: {book_id} 《{book_title}》 {len(selected)} 章, 新增 {added} 个句子任务")
+    return 0
+
+def work(args) -> int:
+    from tts_fish import get_tts_client
+
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    queue = TaskQueue(args.db, max_attempts=args.max_attempts)
+    client = get_tts_client(args.config)
+    # 参考音频在每个 worker 本地缓存为临时文件，各节点无需共享原始路径
+    reference_files = {}
+    processed = 0
+    print(f"Worker {worker_id} 已启动")
+    try:
+        while True:
+            task = queue.lease(worker_id, args.lease, args.book)
+            if task is None:
+                if args.exit_when_idle:
+                    break
+                time.sleep(args.poll)
+                continue
+
+            book = queue.book(task["book_id"])
+            if book["reference_audio"] and task["book_id"] not in reference_files:
+                fd, path = tempfile.mkstemp(suffix=".wav", prefix=f"ref_{task['book_id']}_")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(book["reference_audio"])
+                reference_files[task["book_id"]] = path
+            ref_path = reference_files.get(task["book_id"])
+
+            heartbeat = _LeaseHeartbeat(args.db, task["id"], worker_id, args.lease)
+            heartbeat.start()
+            try:
+                audio = client.synthesize(
+                    text=task["text"],
+                    reference_audios=[ref_path] if ref_path else None,
+                    reference_texts=[book["reference_text"]] if ref_path and book["reference_text"] else None,
+                    output_format="wav"
+                )
+            except Exception as e:
+                log_error(f"Worker {worker_id} task {task['id']} failed: {str(e)}")
+                queue.fail(task["id"], worker_id, str(e))
+                continue
+            finally:
+                heartbeat.stop()
+
+            if not queue.complete(task["id"], worker_id, audio):
+                log_message(f"Worker {worker_id} lost lease on task {task['id']}, result discarded")
+                continue
+            processed += 1
+            if processed % 50 == 0:
+                print(f"{worker_id}: 已完成 {processed} 个任务")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+        for path in reference_files.values():
+            os.remove(path)
+    print(f"Worker {worker_id} 结束，共完成 {processed} 个任务")
+    return 0
+
+def status(args) -> int:
+    queue = TaskQueue(args.db)
+    for book in queue.books():
+        counts = queue.status(book["book_id"])
+        total = sum(counts.values())
+        print(f"{book['book_id']} 《{book['title']}》 完成 {counts[DONE]}/{total}, "
+              f"进行中 {counts[LEASED]}, 等待 {counts[PENDING]}, 失败 {counts[FAILED]}")
+    queue.close()
+    return 0
+
+def _write_chapter(path: str, wav_bytes: bytes, output_format: str):
+    """Write a chapter as WAV, or encode it to output_format with FFmpeg reading from stdin"""
+    if output_format == "wav":
+        with open(path, "wb") as f:
+            f.write(wav_bytes)
+        return
+    from encoder import codec_args
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0"]
+    process = subprocess.run(cmd + codec_args(output_format) + [path], input=wav_bytes,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg 编码失败: {process.stderr.decode('utf-8', errors='replace')}")
+
+def assemble(args) -> int:
+    from tts_fish import merge_wav_segments
+
+    queue = TaskQueue(args.db)
+    books = [queue.book(args.book)] if args.book else queue.books()
+    os.makedirs(args.output, exist_ok=True)
+    exit_code = 0
+    for book in books:
+        if book is None:
+            print(f"错误: 队列中没有这本书: {args.book}")
+            exit_code = 1
+            continue
+        counts = queue.status(book["book_id"])
+        if (counts[PENDING] or counts[LEASED]) and not args.partial:
+            print(f"《{book['title']}》尚未完成 (等待 {counts[PENDING]}, 进行中 {counts[LEASED]})，跳过")
+            exit_code = 1
+            continue
+        for chapter in queue.chapters(book["book_id"]):
+            segments = []
+            for row in queue.chapter_results(book["book_id"], chapter["chapter_index"]):
+                if row["status"] == DONE:
+                    segments.append(row["audio"])
+                else:
+                    # 与 synthesize_long_text 一致：失败的句子跳过
+                    print(f"Warning: 章节 {chapter['chapter_index']} 第 {row['sentence_index']+1} 句缺失 "
+                          f"({row['status']}: {row['error']})")
+            if not segments:
+                continue
+            title = chapter["title"] or f"第{chapter['chapter_index']}章"
+            safe_title = "".join([c if c.isalnum() else "_" for c in title])
+            output_format = (book["output_format"] or "wav").lower()
+            output_file = os.path.join(args.output,
+                                       f"chapter_{chapter['chapter_index']:03d}_{safe_title[:30]}.{output_format}")
+            _write_chapter(output_file, merge_wav_segments(segments), output_format)
+            print(f"✓ 已保存: {os.path.basename(output_file)}")
+    queue.close()
+    return exit_code
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default='queue.sqlite', help='队列数据库路径 (默认: queue.sqlite)')
+    common.add_argument('--max-attempts', type=int, default=3, help='每个任务的最大尝试次数 (默认: 3)')
+
+    parser = argparse.ArgumentParser(description='VoiceLibra - 分布式合成任务队列')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('enqueue', parents=[common], help='解析电子书并把句子任务写入队列')
+    p.add_argument('ebook', help='电子书文件路径')
+    p.add_argument('--voice', '-v', help='声音克隆参考音频文件路径')
+    p.add_argument('--voice-text', help='参考音频对应的文本')
+    p.add_argument('--start', '-s', type=int, default=1, help='起始章节 (默认: 1)')
+    p.add_argument('--end', '-e', type=int, help='结束章节 (默认: 最后一章)')
+    p.add_argument('--format', '-f', default='wav', choices=['wav', 'mp3', 'flac', 'aac', 'm4a'],
+                   help='assemble 输出的章节格式，非 wav 时用 FFmpeg 编码 (默认: wav)')
+    p.set_defaults(func=enqueue)
+
+    p = sub.add_parser('work', parents=[common], help='领取并合成任务')
+    p.add_argument('--config', default='config.json', help='TTS 配置文件 (默认: config.json)')
+    p.add_argument('--worker-id', help='worker 名称 (默认: 主机名-进程号)')
+    p.add_argument('--book', help='只处理指定的书')
+    p.add_argument('--lease', type=float, default=300,
+                   help='租约时长(秒)，合成期间每隔 1/3 租约自动续期 (默认: 300)')
+    p.add_argument('--poll', type=float, default=5, help='队列为空时的轮询间隔(秒) (默认: 5)')
+    p.add_argument('--exit-when-idle', action='store_true', help='队列为空时退出')
+    p.set_defaults(func=work)
+
+    p = sub.add_parser('status', parents=[common], help='查看队列进度')
+    p.set_defaults(func=status)
+
+    p = sub.add_parser('assemble', parents=[common], help='按章节拼接已完成的音频')
+    p.add_argument('--book', help='只拼接指定的书')
+    p.add_argument('--output', '-o', default='output', help='输出目录 (默认: output)')
+    p.add_argument('--partial', action='store_true', help='即使仍有未完成任务也拼接')
+    p.set_defaults(func=assemble)
+
+    args = parser.parse_args()
+    try:
+        return args.func(args)
+    except Exception as e:
+        log_error(f"task_queue {args.command} 出错: {str(e)}")
+        print(f"错误: {str(e)}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
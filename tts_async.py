@@ -0,0 +1,333 @@
+import os
+import asyncio
+import time
+from collections import deque
+from typing import Optional, List, Dict, AsyncIterator, AsyncContextManager, Callable
+
+from tts_fish import (_BaseTTSClient, _segment_context, _clients_lock, merge_wav_segments,
+                      OUTPUT_DIR, LONG_TEXT_THRESHOLD)
+
+class AsyncTTSClient(_BaseTTSClient):
+    """
+    asyncio counterpart of TTSClient.
+    All requests share one aiohttp connection pool, so many in-flight sentences
+    need no extra threads. Cancelling the calling task cancels its pending requests.
+    """
+    def __init__(self, config_path: str = "config.json"):
+        super().__init__(config_path)
+        self._session = None
+        self._session_loop = None
+
+    async def _get_session(self):
+        """Return the connection pool, creating it on first use in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.config["max_connections"])
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def aclose(self):
+        """Close the connection pool"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def check_server(self) -> bool:
+        """Check if TTS server is running"""
+        import aiohttp
+        try:
+            session = await self._get_session()
+            async with session.get(f"http://{self.config['host']}:{self.config['port']}/",
+                                   timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return False
+
+    async def _post(self, text: str, references, output_format: str, streaming: bool,
+                    slot: Optional[Callable[[], AsyncContextManager]] = None) -> bytes:
+        """
+        Send one synthesis request without the server check.
+        If it is still running after the hedge delay, a duplicate is sent through its
+        own slot to the next hedge endpoint; the first success wins and the other is cancelled.
+        The duplicate uses slot.hedge when the slot provides one (see TTSScheduler.slot_factory),
+        so it is not queued behind the caller's other requests.
+        """
+        request = self._build_request(text, references, output_format, streaming)
+        delay = self._hedge_delay(text)
+        if delay is None:
+            return await self._post_once(self.base_url, text, request, slot)
+
+        sent = asyncio.Event()
+        primary = asyncio.ensure_future(self._post_once(self.base_url, text, request, slot, sent, record=False))
+        sent_wait = asyncio.ensure_future(sent.wait())
+        tasks = {primary}
+        try:
+            # 从请求真正发出(拿到槽位)后开始计时；记录从首次发送起的端到端耗时，
+            # 否则副本胜出时会丢掉慢请求，分位数越来越低
+            await asyncio.wait({primary, sent_wait}, return_when=asyncio.FIRST_COMPLETED)
+            sent_at = time.monotonic()
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                audio_data = primary.result()
+                self.latency.record(len(text), time.monotonic() - sent_at)
+                return audio_data
+
+            hedge_slot = getattr(slot, "hedge", slot)
+            tasks.add(asyncio.ensure_future(self._post_once(self._hedge_url(), text, request, hedge_slot,
+                                                            record=False)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.record(len(text), time.monotonic() - sent_at)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            sent_wait.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def _post_once(self, url: str, text: str, request: dict,
+                         slot: Optional[Callable[[], AsyncContextManager]] = None,
+                         sent: Optional[asyncio.Event] = None, record: bool = True) -> bytes:
+        """Send one request to url and record its latency; sent is set once the request goes out"""
+        if slot is not None:
+            # 由调度器(如 TTSScheduler)决定何时允许发送
+            async with slot():
+                return await self._post_once(url, text, request, sent=sent, record=record)
+        if sent is not None:
+            sent.set()
+        import aiohttp
+        session = await self._get_session()
+        start = time.monotonic()
+        async with session.post(url,
+                                timeout=aiohttp.ClientTimeout(total=self._request_timeout(text)),
+                                **request) as response:
+            if response.status != 200:
+                raise RuntimeError(f"TTS API 调用失败 ({response.status}): {await response.text()}")
+            audio_data = await response.read()
+        if record:
+            self.latency.record(len(text), time.monotonic() - start)
+        return audio_data
+
+    async def synthesize(self,
+                         text: str,
+                         reference_audios: Optional[List[str]] = None,
+                         reference_texts: Optional[List[str]] = None,
+                         output_format: str = "wav",
+                         streaming: bool = None,
+                         slot: Optional[Callable[[], AsyncContextManager]] = None,
+                         store=None,
+                         key: Optional[tuple] = None) -> bytes:
+        """
+        Async version of TTSClient.synthesize
+
+        slot: optional zero-argument callable returning an async context manager
+              that is held while the request is in flight (see TTSScheduler)
+        store, key: optional SegmentStore and (chapter, sentence); a segment stored
+              for the same text and voice is returned without a request
+        """
+        references = await asyncio.to_thread(self._load_references, reference_audios, reference_texts)
+        tag = None
+        if store is not None:
+            from segment_store import segment_tag
+            tag = segment_tag(text, _segment_context(references, output_format))
+            cached = store.get(*key, tag)
+            if cached is not None:
+                return cached
+        if not await self.check_server():
+            raise ConnectionError(self._server_error_message())
+        audio_data = await self._post(text, references, output_format, streaming, slot)
+        if store is not None:
+            await asyncio.to_thread(store.put, *key, audio_data, tag)
+        return audio_data
+
+    async def stream(self,
+                     text: str,
+                     reference_audios: Optional[List[str]] = None,
+                     reference_texts: Optional[List[str]] = None,
+                     output_format: str = "wav",
+                     chunk_size: int = 8192) -> AsyncIterator[bytes]:
+        """
+        使用服务器的流式模式合成，按收到的顺序逐块产出音频数据
+        """
+        import aiohttp
+        if not await self.check_server():
+            raise ConnectionError(self._server_error_message())
+        references = await asyncio.to_thread(self._load_references, reference_audios, reference_texts)
+        session = await self._get_session()
+        async with session.post(self.base_url,
+                                timeout=aiohttp.ClientTimeout(total=None, sock_read=self.config["timeout"]),
+                                **self._build_request(text, references, output_format, True)) as response:
+            if response.status != 200:
+                raise RuntimeError(f"TTS API 调用失败 ({response.status}): {await response.text()}")
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def iter_long_text(self,
+                             text: str,
+                             reference_audios: Optional[List[str]] = None,
+                             reference_texts: Optional[List[str]] = None,
+                             output_format: str = "wav",
+                             streaming: bool = None,
+                             progress_callback = None,
+                             max_concurrency: Optional[int] = None,
+                             slot: Optional[Callable[[], AsyncContextManager]] = None,
+                             store=None,
+                             chapter: int = 0) -> AsyncIterator[bytes]:
+        """
+        将长文本分句后并发合成，按句子顺序逐段产出音频数据
+
+        最多同时发送 max_concurrency 个请求(默认为 config["max_connections"])，
+        每个请求发送期间持有 slot() 返回的上下文(如有)。
+        迭代提前结束或被取消时，尚未完成的请求会一并取消。
+        指定 store (SegmentStore) 时按 (chapter, 句子序号) 复用已合成的句子，新合成的句子写入 store。
+        """
+        sentences = self.split_into_sentences(text)
+        indexed = [(i, sentence) for i, sentence in enumerate(sentences) if sentence.strip()]
+        if not indexed:
+            return
+        references = await asyncio.to_thread(self._load_references, reference_audios, reference_texts)
+        tags = {}
+        if store is not None:
+            from segment_store import segment_tag
+            context = _segment_context(references, output_format)
+            tags = {i: segment_tag(sentence, context) for i, sentence in indexed}
+        # 全部句子都已缓存时无需连接服务器
+        if store is None or not all(store.has(chapter, i, tags[i]) for i, _ in indexed):
+            if not await self.check_server():
+                raise ConnectionError(self._server_error_message())
+
+        window = max(1, max_concurrency or self.config["max_connections"])
+        pending = deque()
+        next_pos = 0
+        try:
+            while pending or next_pos < len(indexed):
+                # 保持窗口内始终有 window 个请求在进行
+                while next_pos < len(indexed) and len(pending) < window:
+                    i, sentence = indexed[next_pos]
+                    cached = store.get(chapter, i, tags[i]) if store is not None else None
+                    if cached is not None:
+                        task = asyncio.get_running_loop().create_future()
+                        task.set_result(cached)
+                    else:
+                        task = asyncio.ensure_future(self._post(sentence, references, output_format, streaming, slot))
+                    pending.append((i, sentence, cached is None, task))
+                    next_pos += 1
+
+                i, sentence, fresh, task = pending.popleft()
+                try:
+                    audio_data = await task
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Warning: Failed to synthesize sentence: {sentence[:50]}... Error: {str(e)}")
+                    continue
+                if fresh and store is not None:
+                    await asyncio.to_thread(store.put, chapter, i, audio_data, tags[i])
+
+                # 报告进度
+                if progress_callback:
+                    progress = (i + 1) / len(sentences) * 100
+                    progress_callback(f"正在合成第 {i+1}/{len(sentences)} 句 ({progress:.1f}%)")
+                yield audio_data
+        finally:
+            for _, _, _, task in pending:
+                task.cancel()
+
+    async def synthesize_long_text(self,
+                                   text: str,
+                                   reference_audios: Optional[List[str]] = None,
+                                   reference_texts: Optional[List[str]] = None,
+                                   output_format: str = "wav",
+                                   streaming: bool = None,
+                                   progress_callback = None,
+                                   max_concurrency: Optional[int] = None,
+                                   slot: Optional[Callable[[], AsyncContextManager]] = None,
+                                   store=None,
+                                   chapter: int = 0) -> List[bytes]:
+        """Async version of TTSClient.synthesize_long_text, sentences are synthesized concurrently"""
+        return [audio_data async for audio_data in self.iter_long_text(
+            text=text,
+            reference_audios=reference_audios,
+            reference_texts=reference_texts,
+            output_format=output_format,
+            streaming=streaming,
+            progress_callback=progress_callback,
+            max_concurrency=max_concurrency,
+            slot=slot,
+            store=store,
+            chapter=chapter
+        )]
+
+_async_clients: Dict[str, AsyncTTSClient] = {}
+
+def get_async_tts_client(config_path: str = "config.json") -> AsyncTTSClient:
+    """Return the shared AsyncTTSClient for the given config file, creating it on first use"""
+    key = os.path.abspath(config_path)
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncTTSClient(config_path)
+            _async_clients[key] = client
+    return client
+
+async def async_test_voice_clone(reference_audio_path: str, reference_text: str = None, slot=None) -> bytes:
+    """Async version of test_voice_clone"""
+    test_text = "这是一个测试音频，用于确认声音克隆的效果。"
+    return await get_async_tts_client().synthesize(
+        text=test_text,
+        reference_audios=[reference_audio_path],
+        reference_texts=[reference_text] if reference_text else None,
+        slot=slot
+    )
+
+async def async_synthesize_text(text: str,
+                                reference_audio_path: str = None,
+                                reference_text: str = None,
+                                output_format: str = "wav",
+                                slot=None,
+                                store=None,
+                                chapter: int = 0) -> bytes:
+    """
+    Async version of synthesize_text, long texts are synthesized sentence by sentence concurrently.
+    slot is passed through to AsyncTTSClient (see TTSScheduler.slot_factory).
+    With a SegmentStore, segments already synthesized for this chapter are reused
+    and new ones are saved, so an interrupted conversion resumes where it stopped.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    client = get_async_tts_client()
+    if len(text) > LONG_TEXT_THRESHOLD:  # 如果文本较长，使用分句合成
+        segments = await client.synthesize_long_text(
+            text=text,
+            reference_audios=[reference_audio_path] if reference_audio_path else None,
+            reference_texts=[reference_text] if reference_text else None,
+            output_format=output_format,
+            slot=slot,
+            store=store,
+            chapter=chapter
+        )
+        return merge_wav_segments(segments)
+    else:  # 短文本直接合成
+        return await client.synthesize(
+            text=text,
+            reference_audios=[reference_audio_path] if reference_audio_path else None,
+            reference_texts=[reference_text] if reference_text else None,
+            output_format=output_format,
+            slot=slot,
+            store=store,
+            key=(chapter, 0) if store is not None else None
+        )
@@ -1,30 +1,144 @@
-import requests
-import ormsgpack
 import os
 import json
 import io
 import wave
+import threading
+import time
+from collections import deque
 from typing import Optional, List, Dict, Union
-from tqdm import tqdm
 
-# 确保输出目录存在
+# 输出目录(在首次合成时创建，导入模块时不产生副作用)
 OUTPUT_DIR = "output"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# synthesize_text 对超过该长度的文本分句合成，否则整段一次请求
+LONG_TEXT_THRESHOLD = 1000
 
 # 默认配置
 DEFAULT_CONFIG = {
     "host": "127.0.0.1",
     "port": 8080,
     "max_retries": 3,
-    "timeout": 60,
-    "streaming": False
+    "timeout": 60,  # 每个请求的超时(秒)，也是流式请求的读取超时
+    # 设置 timeout_per_char > 0 时超时随文本长度增长: min(timeout_max, timeout_base + timeout_per_char * 字符数)
+    "timeout_base": 10,
+    "timeout_per_char": 0,
+    "timeout_max": 600,
+    # 请求耗时超过最近请求(按长度折算)的该分位数时，向另一个槽位/服务器发送副本，先返回者为准(0 表示关闭)
+    "hedge_percentile": 0,
+    "hedge_min_samples": 20,
+    "hedge_endpoints": [],  # 副本请求可用的其他服务器，如 ["10.0.0.2:8080"]；为空时发往同一服务器
+    "streaming": False,
+    "max_connections": 16,  # AsyncTTSClient 连接池大小及单段长文本的并发句数
+    # TTSScheduler: 服务器同时处理的请求数、为试听保留的槽位、每个用户批量任务的并发上限
+    "scheduler_slots": 4,
+    "scheduler_reserved_interactive": 1,
+    "scheduler_per_user_limit": 2,
+    # 解析完成后在后台预合成前 N 章的试听段落(0 表示关闭)，以及试听缓存的条目上限
+    "preview_prefetch_chapters": 0,
+    "preview_cache_size": 64
 }
 
-class TTSClient:
+def _segment_context(references: Optional[List[dict]], output_format: str) -> bytes:
+    """Reference audio, reference texts and output format, part of the segment cache tag"""
+    return output_format.encode() + b"".join(r["audio"] + r["text"].encode("utf-8") for r in references or [])
+
+def split_into_sentences(text: str) -> list:
+    """将文本分割成句子"""
+    # 定义句子结束标记
+    end_marks = ['。', '！', '？', '!', '?', '.']
+    # 定义不应该分割的情况(如 Mr. Dr. 等)
+    exceptions = ['Mr.', 'Mrs.', 'Dr.', 'Ph.D.', 'etc.', 'e.g.', 'i.e.']
+    
+    sentences = []
+    current_sentence = ""
+    
+    i = 0
+    while i < len(text):
+        char = text[i]
+        current_sentence += char
+        
+        # 检查是否是句子结束
+        if char in end_marks:
+            # 检查是否是例外情况
+            is_exception = False
+            for exc in exceptions:
+                if text[max(0, i-len(exc)+1):i+1] == exc:
+                    is_exception = True
+                    break
+            
+            # 如果不是例外，则添加到结果中
+            if not is_exception:
+                current_sentence = current_sentence.strip()
+                if current_sentence:
+                    sentences.append(current_sentence)
+                current_sentence = ""
+        
+        i += 1
+    
+    # 处理最后一个句子
+    if current_sentence.strip():
+        sentences.append(current_sentence.strip())
+    
+    return sentences
+
+class LatencyTracker:
+    """
+    Recent request latencies normalized by text length.
+    Texts shorter than MIN_CHARS count as MIN_CHARS so per-request overhead does
+    not make short sentences look slow.
+    """
+    MIN_CHARS = 20
+
+    def __init__(self, size: int = 256):
+        self._rates = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, chars: int, seconds: float):
+        with self._lock:
+            self._rates.append(seconds / max(chars, self.MIN_CHARS))
+
+    def percentile(self, chars: int, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Latency in seconds that pct percent of recent requests of this length finished within"""
+        with self._lock:
+            if not self._rates or len(self._rates) < min_samples:
+                return None
+            rates = sorted(self._rates)
+        index = min(len(rates) - 1, int(len(rates) * pct / 100))
+        return rates[index] * max(chars, self.MIN_CHARS)
+
+class _BaseTTSClient:
+    """Configuration, payload encoding and sentence splitting shared by the sync and async clients"""
     def __init__(self, config_path: str = "config.json"):
         self.config = self._load_config(config_path)
         self.base_url = f"http://{self.config['host']}:{self.config['port']}/v1/tts"
-        
+        self.latency = LatencyTracker()
+        self._hedge_counter = 0
+
+    def _request_timeout(self, text: str) -> float:
+        """Timeout for one request, scaled with the text length"""
+        per_char = self.config["timeout_per_char"]
+        if not per_char or per_char <= 0:
+            return self.config["timeout"]
+        return min(self.config["timeout_max"], self.config["timeout_base"] + per_char * len(text))
+
+    def _hedge_delay(self, text: str) -> Optional[float]:
+        """Seconds after which a duplicate request is sent, None when hedging is off or there is no history yet"""
+        pct = self.config["hedge_percentile"]
+        if not pct or pct <= 0:
+            return None
+        return self.latency.percentile(len(text), pct, self.config["hedge_min_samples"])
+
+    def _hedge_url(self) -> str:
+        """Endpoint for the next duplicate request, rotating over hedge_endpoints"""
+        endpoints = self.config["hedge_endpoints"]
+        if not endpoints:
+            return self.base_url
+        endpoint = endpoints[self._hedge_counter % len(endpoints)]
+        self._hedge_counter += 1
+        if "://" not in endpoint:
+            endpoint = f"http://{endpoint}"
+        return endpoint.rstrip("/") + "/v1/tts"
+
     def _load_config(self, config_path: str) -> dict:
         """Load configuration from file or use defaults"""
         if os.path.exists(config_path):
@@ -32,10 +146,83 @@ class TTSClient:
                 return {**DEFAULT_CONFIG, **json.load(f)}
         return DEFAULT_CONFIG
 
+    def _server_error_message(self) -> str:
+        return (
+            f"\n 无法连接到 Fish-Speech TTS 服务器 ({self.base_url} )。\n"
+            "请确保已经运行以下命令启动服务器:\n"
+            "python -m tools.api_server \\\n"
+            "    --listen 0.0.0.0:8080 \\\n"
+            "    --llama-checkpoint-path checkpoints/fish-speech-1.5 \\\n"
+            "    --decoder-checkpoint-path checkpoints/fish-speech-1.5/firefly-gan-vq-fsq-8x1024-21hz-generator.pth \\\n"
+            "    --decoder-config-name firefly_gan_vq"
+        )
+
+    def _load_references(self,
+                         reference_audios: Optional[List[str]],
+                         reference_texts: Optional[List[str]]) -> Optional[List[dict]]:
+        """读取参考音频，返回 API 所需的 references 列表"""
+        if not reference_audios:
+            return None
+        references = []
+        for i, audio_path in enumerate(reference_audios):
+            with open(audio_path, "rb") as f:
+                audio_bytes = f.read()
+            references.append({
+                "audio": audio_bytes,
+                "text": reference_texts[i] if reference_texts and i < len(reference_texts) else ""
+            })
+        return references
+
+    def _build_request(self,
+                       text: str,
+                       references: Optional[List[dict]],
+                       output_format: str,
+                       streaming: bool) -> dict:
+        """Build the keyword arguments (body and headers) for a POST to the TTS endpoint"""
+        # Prepare payload
+        payload = {
+            "text": text,
+            "format": output_format,
+            "streaming": streaming if streaming is not None else self.config["streaming"]
+        }
+
+        # Add references if provided
+        if references:
+            payload["references"] = references
+
+            # Use MessagePack for requests with audio data
+            import ormsgpack
+            headers = {"Content-Type": "application/msgpack"}
+            data = ormsgpack.packb(payload, option=ormsgpack.OPT_SERIALIZE_PYDANTIC)
+            return {"data": data, "headers": headers}
+        # Use JSON for simple requests
+        return {"json": payload}
+
+    def split_into_sentences(self, text: str) -> list:
+        """将文本分割成句子"""
+        return split_into_sentences(text)
+
+class TTSClient(_BaseTTSClient):
+    def __init__(self, config_path: str = "config.json"):
+        super().__init__(config_path)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def session(self):
+        """Shared HTTP session, created on first use so connections are reused"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    self._session = requests.Session()
+        return self._session
+
     def check_server(self) -> bool:
         """Check if TTS server is running"""
         try:
-            response = requests.get(f"http://{self.config['host']}:{self.config['port']}/", 
+            response = self.session.get(f"http://{self.config['host']}:{self.config['port']}/", 
                                   timeout=5)
             return response.status_code == 200
         except:
@@ -58,88 +245,58 @@ class TTSClient:
             streaming: Whether to use streaming mode
         """
         if not self.check_server():
-            raise ConnectionError(
-                f"\n 无法连接到 Fish-Speech TTS 服务器 ({self.base_url} )。\n"
-                "请确保已经运行以下命令启动服务器:\n"
-                "python -m tools.api_server \\\n"
-                "    --listen 0.0.0.0:8080 \\\n"
-                "    --llama-checkpoint-path checkpoints/fish-speech-1.5 \\\n"
-                "    --decoder-checkpoint-path checkpoints/fish-speech-1.5/firefly-gan-vq-fsq-8x1024-21hz-generator.pth \\\n"
-                "    --decoder-config-name firefly_gan_vq"
-            )
+            raise ConnectionError(self._server_error_message())
 
-        # Prepare payload
-        payload = {
-            "text": text,
-            "format": output_format,
-            "streaming": streaming if streaming is not None else self.config["streaming"]
-        }
+        references = self._load_references(reference_audios, reference_texts)
+        return self._hedged_post(text, self._build_request(text, references, output_format, streaming))
 
-        # Add references if provided
-        if reference_audios:
-            references = []
-            for i, audio_path in enumerate(reference_audios):
-                with open(audio_path, "rb") as f:
-                    audio_bytes = f.read()
-                references.append({
-                    "audio": audio_bytes,
-                    "text": reference_texts[i] if reference_texts and i < len(reference_texts) else ""
-                })
-            payload["references"] = references
-            
-            # Use MessagePack for requests with audio data
-            headers = {"Content-Type": "application/msgpack"}
-            data = ormsgpack.packb(payload, option=ormsgpack.OPT_SERIALIZE_PYDANTIC)
-            response = requests.post(self.base_url, data=data, headers=headers, 
-                                  timeout=self.config["timeout"])
-        else:
-            # Use JSON for simple requests
-            response = requests.post(self.base_url, json=payload, 
-                                  timeout=self.config["timeout"])
+    def _post(self, url: str, text: str, request: dict, record: bool = True) -> bytes:
+        """Send one synthesis request and record its latency"""
+        start = time.monotonic()
+        response = self.session.post(url, timeout=self._request_timeout(text), **request)
 
         if response.status_code != 200:
             raise RuntimeError(f"TTS API 调用失败 ({response.status_code}): {response.text}")
-            
+
+        if record:
+            self.latency.record(len(text), time.monotonic() - start)
         return response.content
 
-    def split_into_sentences(self, text: str) -> list:
-        """将文本分割成句子"""
-        # 定义句子结束标记
-        end_marks = ['。', '！', '？', '!', '?', '.']
-        # 定义不应该分割的情况(如 Mr. Dr. 等)
-        exceptions = ['Mr.', 'Mrs.', 'Dr.', 'Ph.D.', 'etc.', 'e.g.', 'i.e.']
-        
-        sentences = []
-        current_sentence = ""
-        
-        i = 0
-        while i < len(text):
-            char = text[i]
-            current_sentence += char
-            
-            # 检查是否是句子结束
-            if char in end_marks:
-                # 检查是否是例外情况
-                is_exception = False
-                for exc in exceptions:
-                    if text[max(0, i-len(exc)+1):i+1] == exc:
-                        is_exception = True
-                        break
-                
-                # 如果不是例外，则添加到结果中
-                if not is_exception:
-                    current_sentence = current_sentence.strip()
-                    if current_sentence:
-                        sentences.append(current_sentence)
-                    current_sentence = ""
-            
-            i += 1
-        
-        # 处理最后一个句子
-        if current_sentence.strip():
-            sentences.append(current_sentence.strip())
-        
-        return sentences
+    def _hedged_post(self, text: str, request: dict) -> bytes:
+        """
+        Send the request; if it is still running after the hedge delay, send a
+        duplicate to the next hedge endpoint and return whichever succeeds first
+        """
+        delay = self._hedge_delay(text)
+        if delay is None:
+            return self._post(self.base_url, text, request)
+
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        with self._session_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.config["max_connections"] * 2,
+                                                    thread_name_prefix="tts-hedge")
+        # 记录从首次发送起的端到端耗时，否则副本胜出时会丢掉慢请求，分位数越来越低
+        start = time.monotonic()
+        primary = self._executor.submit(self._post, self.base_url, text, request, False)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            audio_data = primary.result()
+            self.latency.record(len(text), time.monotonic() - start)
+            return audio_data
+
+        hedge = self._executor.submit(self._post, self._hedge_url(), text, request, False)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # requests 无法中断，较慢的请求在后台线程结束后被丢弃
+                    self.latency.record(len(text), time.monotonic() - start)
+                    return future.result()
+                error = future.exception()
+        raise error
 
     def synthesize_long_text(self, 
                             text: str,
@@ -190,18 +347,69 @@ class TTSClient:
                 
         return audio_segments
 
-# Create global client instance
-tts_client = TTSClient()
+_clients: Dict[str, TTSClient] = {}
+_clients_lock = threading.Lock()
+
+def get_tts_client(config_path: str = "config.json") -> TTSClient:
+    """
+    Return the shared TTSClient for the given config file, creating it on first use.
+    All callers in a process reuse one client and therefore one connection pool.
+    """
+    key = os.path.abspath(config_path)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = TTSClient(config_path)
+                _clients[key] = client
+    return client
+
+# asyncio 客户端在 tts_async 中，按需导入，同步的 CLI 和任务进程无需加载 asyncio
+_ASYNC_NAMES = ("AsyncTTSClient", "get_async_tts_client", "async_test_voice_clone", "async_synthesize_text")
+
+def __getattr__(name):
+    # 兼容旧代码中的 tts_client 全局变量，按需创建
+    if name == "tts_client":
+        return get_tts_client()
+    if name in _ASYNC_NAMES:
+        import tts_async
+        return getattr(tts_async, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def test_voice_clone(reference_audio_path: str, reference_text: str = None) -> bytes:
     """Test voice cloning with a sample sentence"""
     test_text = "这是一个测试音频，用于确认声音克隆的效果。"
-    return tts_client.synthesize(
+    return get_tts_client().synthesize(
         text=test_text,
         reference_audios=[reference_audio_path],
         reference_texts=[reference_text] if reference_text else None
     )
 
+def merge_wav_segments(segments: List[bytes], show_progress: bool = False) -> bytes:
+    """将多个WAV音频片段按顺序合并为一个WAV文件"""
+    with io.BytesIO() as outfile:
+        with wave.open(outfile, 'wb') as wf:
+            first_segment = True
+            # 创建进度条
+            pbar = None
+            if show_progress:
+                from tqdm import tqdm
+                pbar = tqdm(total=len(segments), desc="合并音频片段")
+            for audio_data in segments:
+                with wave.open(io.BytesIO(audio_data), 'rb') as infile:
+                    if first_segment:
+                        wf.setnchannels(infile.getnchannels())
+                        wf.setsampwidth(infile.getsampwidth())
+                        wf.setframerate(infile.getframerate())
+                        first_segment = False
+                    wf.writeframes(infile.readframes(infile.getnframes()))
+                if pbar:
+                    pbar.update(1)  # 更新进度条
+            if pbar:
+                pbar.close()  # 关闭进度条
+        return outfile.getvalue()
+
 def synthesize_text(text: str, 
                    reference_audio_path: str = None, 
                    reference_text: str = None, 
@@ -210,34 +418,19 @@ def synthesize_text(text: str,
     # 确保输出目录存在
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    if len(text) > 1000:  # 如果文本较长，使用分句合成
-        segments = tts_client.synthesize_long_text(
+    if len(text) > LONG_TEXT_THRESHOLD:  # 如果文本较长，使用分句合成
+        segments = get_tts_client().synthesize_long_text(
             text=text,
             reference_audios=[reference_audio_path] if reference_audio_path else None,
             reference_texts=[reference_text] if reference_text else None,
             output_format=output_format
         )
         # 合并音频片段
-        with io.BytesIO() as outfile:
-            with wave.open(outfile, 'wb') as wf:
-                first_segment = True
-                # 创建进度条
-                pbar = tqdm(total=len(segments), desc="合并音频片段")
-                for audio_data in segments:
-                    with wave.open(io.BytesIO(audio_data), 'rb') as infile:
-                        if first_segment:
-                            wf.setnchannels(infile.getnchannels())
-                            wf.setsampwidth(infile.getsampwidth())
-                            wf.setframerate(infile.getframerate())
-                            first_segment = False
-                        wf.writeframes(infile.readframes(infile.getnframes()))
-                    pbar.update(1)  # 更新进度条
-                pbar.close()  # 关闭进度条
-            return outfile.getvalue()
+        return merge_wav_segments(segments, show_progress=True)
     else:  # 短文本直接合成
-        return tts_client.synthesize(
+        return get_tts_client().synthesize(
             text=text,
             reference_audios=[reference_audio_path] if reference_audio_path else None,
             reference_texts=[reference_text] if reference_text else None,
             output_format=output_format
-        )
\ No newline at end of file
+        )
@@ -1,24 +1,35 @@
 import os
+import time
 import shutil
 import base64
 import wave
-import subprocess
 import gradio as gr
 import io
+import html
+import hashlib
 
 from debug_log import log_message, log_error, log_file_status
-from parser import convert_to_epub, parse_epub, get_first_paragraph
-from tts_fish import synthesize_text, test_voice_clone, TTSClient
+from parser import convert_to_epub, parse_book_file, has_native_parser, get_first_paragraph
+from tts_async import async_synthesize_text, async_test_voice_clone
+from scheduler import get_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from preview_cache import get_preview_prefetcher
+from planner import plan_conversion, format_plan, record_throughput, count_requests, MODE_UI
+from profiling import JobProfiler, job_name
+from segment_store import get_segment_store, discard_segment_store
+from encoder import (PipeEncoder, ShardedEncoder, CHAPTER_FORMATS, write_ffmetadata, write_concat_list,
+                     concat_command, run_ffmpeg_parallel, part_limit_seconds, split_parts, part_path)
 
-# 创建全局TTS客户端实例
-tts_client = TTSClient()
+def _session_id(request: gr.Request) -> str:
+    """Identify the browser session for per-user scheduling"""
+    return getattr(request, "session_hash", None) or "anonymous"
 
-def test_voice_cloning(reference_audio):
+async def test_voice_cloning(reference_audio, request: gr.Request = None):
     """Test voice cloning with a sample sentence"""
     if not reference_audio:
         return "请先上传参考音频文件。", None
     try:
-        audio_bytes = test_voice_clone(reference_audio.name)
+        slot = get_scheduler().slot_factory(PRIORITY_INTERACTIVE, _session_id(request))
+        audio_bytes = await async_test_voice_clone(reference_audio.name, slot=slot)
         # Save temporary wav file for preview
         temp_file = "output/voice_test.wav"
         os.makedirs("output", exist_ok=True)
@@ -28,7 +39,7 @@ def test_voice_cloning(reference_audio):
     except Exception as e:
         return f"声音克隆测试失败: {str(e)}", None
 
-def test_chapter_synthesis(state, reference_audio, chapter_index):
+async def test_chapter_synthesis(state, reference_audio, chapter_index, request: gr.Request = None):
     """Test synthesize first paragraph of selected chapter"""
     if not state or "chapters" not in state:
         return "请先上传并解析电子书。", None
@@ -44,7 +55,13 @@ def test_chapter_synthesis(state, reference_audio, chapter_index):
         
     try:
         ref_path = reference_audio.name if reference_audio else None
-        audio_bytes = synthesize_text(first_para, ref_path)
+        prefetcher = get_preview_prefetcher()
+        # 优先使用后台预合成的结果
+        audio_bytes = await prefetcher.get(first_para, ref_path)
+        if audio_bytes is None:
+            slot = get_scheduler().slot_factory(PRIORITY_INTERACTIVE, _session_id(request))
+            audio_bytes = await async_synthesize_text(first_para, ref_path, slot=slot)
+            prefetcher.put(first_para, ref_path, audio_bytes, _session_id(request))
         # Save temporary wav file
         temp_file = f"output/chapter_{chapter_index+1}_test.wav"
         os.makedirs("output", exist_ok=True)
@@ -54,7 +71,41 @@ def test_chapter_synthesis(state, reference_audio, chapter_index):
     except Exception as e:
         return f"章节测试合成失败: {str(e)}", None
 
-def parse_book(file_obj):
+async def prefetch_chapter_previews(state, reference_audio, request: gr.Request = None):
+    """
+    After parsing, synthesize the preview paragraph of the first N chapters in the
+    background (lowest priority) so that "测试章节合成" is instant.
+    """
+    if not state or "chapters" not in state:
+        return
+    prefetcher = get_preview_prefetcher()
+    count = prefetcher.scheduler.client.config["preview_prefetch_chapters"]
+    if count <= 0:
+        return
+    user = _session_id(request)
+    # 新书解析后，丢弃该会话尚未开始的旧预合成任务
+    prefetcher.cancel_pending(user)
+    ref_path = reference_audio.name if reference_audio else None
+    for chapter in state["chapters"][:count]:
+        prefetcher.prefetch(get_first_paragraph(chapter["text"]), ref_path, user)
+
+async def prefetch_selected_chapter(state, reference_audio, chapter_index, request: gr.Request = None):
+    """Prefetch the preview paragraph of the chapter the user just selected"""
+    if not state or "chapters" not in state:
+        return
+    prefetcher = get_preview_prefetcher()
+    if prefetcher.scheduler.client.config["preview_prefetch_chapters"] <= 0:
+        return
+    try:
+        chapter_index = int(chapter_index)
+    except (TypeError, ValueError):
+        return
+    chapters = state["chapters"]
+    if 0 <= chapter_index < len(chapters):
+        ref_path = reference_audio.name if reference_audio else None
+        prefetcher.prefetch(get_first_paragraph(chapters[chapter_index]["text"]), ref_path, _session_id(request))
+
+def parse_book(file_obj, profile=False):
     """
     Gradio event function to parse the uploaded book file into chapters.
     Returns (preview_html, state_dict).
@@ -64,16 +115,26 @@ def parse_book(file_obj):
     # Determine original file path
     input_path = file_obj.name
     orig_name = getattr(file_obj, "orig_name", None)
-    # Convert to EPUB if needed
+    profiler = JobProfiler(os.path.join(os.getcwd(), "output"),
+                           job_name(os.path.splitext(orig_name or os.path.basename(input_path))[0]),
+                           enabled=bool(profile))
+    try:
+        with profiler.phase("parse"):
+            return _parse_book(input_path, orig_name)
+    finally:
+        profiler.close()
+
+def _parse_book(input_path, orig_name):
+    # Convert to EPUB if needed (EPUB/TXT/HTML/FB2 are parsed directly without Calibre)
     try:
-        epub_path = convert_to_epub(input_path)
+        book_path = input_path if has_native_parser(input_path) else convert_to_epub(input_path)
     except Exception as e:
         # Return error message in preview if conversion fails
         err_msg = f"<p style='color:red'><strong>Error:</strong> {str(e)}</p>"
         return gr.update(value=err_msg), {}
-    # Parse EPUB to chapters
+    # Parse book to chapters
     try:
-        book_title, chapters = parse_epub(epub_path)
+        book_title, chapters = parse_book_file(book_path)
     except Exception as e:
         err_msg = f"<p style='color:red'><strong>Failed to parse book:</strong> {str(e)}</p>"
         return gr.update(value=err_msg), {}
@@ -96,11 +157,25 @@ def parse_book(file_obj):
     preview_html = "<p><strong>Chapters Detected:</strong></p>\n" + "<br>".join(preview_lines)
     return gr.update(value=preview_html), state
 
-def convert_to_audio(state, reference_audio, output_format, start_chapter, end_chapter):
+async def convert_to_audio(state, reference_audio, output_format, start_chapter, end_chapter,
+                           profile=False, stream_encode=True, part_hours=0, part_size_mb=0,
+                           resume=False, request: gr.Request = None):
     """
     Gradio event function to convert parsed chapters to audiobook.
     Uses Fish-Speech TTS for each chapter and ffmpeg to merge with metadata.
+    With stream_encode, chapter PCM is piped straight into one FFmpeg encoder instead
+    of being written to temporary WAV files and concatenated afterwards.
+    part_hours / part_size_mb split the book at chapter boundaries into
+    "Part 1..N" files with their own chapter metadata, encoded in parallel.
+    With resume, synthesized sentences are kept in a segment store so an interrupted
+    conversion can be resumed; the store is deleted once the output is written.
+    With profile enabled, the synthesis and merge phases are profiled and the
+    artifacts are written to the output directory.
     """
+    profiler = JobProfiler(os.path.join(os.getcwd(), "output"),
+                           job_name(os.path.splitext((state or {}).get("orig_name", "output"))[0]),
+                           enabled=bool(profile))
+    encoder = None
     try:
         log_message("Starting convert_to_audio function")
         if not state or "chapters" not in state:
@@ -133,7 +208,36 @@ def convert_to_audio(state, reference_audio, output_format, start_chapter, end_c
         os.makedirs(out_dir, exist_ok=True)
         log_message(f"Output directory: {out_dir}")
 
-        # Generate audio for selected chapters
+        # Determine final output file name and path
+        base_name = os.path.splitext(orig_name)[0]
+        final_file_name = f"{base_name}.{output_format.lower()}"
+        final_path = os.path.join(out_dir, final_file_name)
+        
+        log_message(f"Final output file will be: {final_path}")
+        
+        # 在开始合并前删除可能存在的旧文件
+        if os.path.exists(final_path):
+            try:
+                os.remove(final_path)
+            except Exception as e:
+                yield f"<p style='color:orange'>警告：无法删除旧文件: {str(e)}</p>", None, None
+
+        part_seconds = part_limit_seconds(output_format, part_hours, part_size_mb)
+        if stream_encode and part_seconds:
+            encoder = ShardedEncoder(final_path, output_format, book_title if book_title else orig_name, part_seconds)
+        elif stream_encode:
+            encoder = PipeEncoder(final_path, output_format, book_title if book_title else orig_name)
+
+        # 断点续转：已合成的句子保存在每本书一个的分段存储中，中断后重新转换会直接复用
+        store = None
+        if resume:
+            store = get_segment_store(os.path.join(out_dir, "segments"),
+                                      hashlib.sha1(f"{orig_name}\0{book_title}".encode("utf-8")).hexdigest()[:16])
+            store_hits = store.hits
+
+        # Generate audio for selected chapters (bulk priority, previews jump ahead of these requests)
+        slot = get_scheduler().slot_factory(PRIORITY_BULK, _session_id(request))
+        synthesis_started = time.time()
         chapter_files = []
         for idx, ch in enumerate(selected_chapters, start=1):
             chapter_title = ch["title"]
@@ -152,8 +256,16 @@ def convert_to_audio(state, reference_audio, output_format, start_chapter, end_c
             
             try:
                 # 合成文本
-                audio_bytes = synthesize_text(chapter_text, reference_audio.name if reference_audio else None)
+                with profiler.phase("synthesis"):
+                    audio_bytes = await async_synthesize_text(chapter_text, reference_audio.name if reference_audio else None,
+                                                              slot=slot, store=store, chapter=start_chapter+idx-1)
                 
+                if encoder is not None:
+                    # 直接送入编码器，不写临时文件
+                    with profiler.phase("merge"):
+                        await encoder.add_chapter(chapter_title, audio_bytes)
+                    continue
+
                 # 保存章节音频
                 chap_file = os.path.join(out_dir, f"temp_chapter_{start_chapter+idx-1:03d}.wav")
                 with open(chap_file, "wb") as f:
@@ -162,6 +274,8 @@ def convert_to_audio(state, reference_audio, output_format, start_chapter, end_c
                 chapter_files.append((chapter_title, chap_file))
                 
             except Exception as e:
+                if encoder is not None:
+                    await encoder.abort()
                 error_html = f"""
                 <div style='padding: 15px; border: 1px solid #dc3545; border-radius: 5px;'>
                     <h3 style='color: #dc3545;'>❌ 合成失败</h3>
@@ -172,6 +286,8 @@ def convert_to_audio(state, reference_audio, output_format, start_chapter, end_c
                 yield error_html, None, None
                 return
 
+        synthesis_elapsed = time.time() - synthesis_started
+
         # 显示合并进度
         merge_html = f"""
         <div style='padding: 10px; border: 1px solid #ccc; border-radius: 5px;'>
@@ -183,144 +299,125 @@ def convert_to_audio(state, reference_audio, output_format, start_chapter, end_c
         """
         yield merge_html, None, None
         
-        # Prepare metadata file for chapters
-        metadata_path = os.path.join(out_dir, "chapters.txt")
-        supports_chapters = output_format.lower() in ["m4b", "m4a", "mp4", "mov", "webm"]
-        chapter_durations_ms = []
-        total_duration_ms = 0
-        for (title, chap_file) in chapter_files:
-            # Get duration in ms using wave module (since we saved as wav)
-            try:
-                w = wave.open(chap_file, 'rb')
-                frames = w.getnframes()
-                rate = w.getframerate()
-                w.close()
-                # integer milliseconds
-                duration_ms = int(frames * 1000 / rate)
-            except Exception:
-                duration_ms = 0
-            chapter_durations_ms.append(duration_ms)
-        if supports_chapters:
-            with open(metadata_path, "w", encoding="utf-8") as mf:
-                mf.write(";FFMETADATA1\n")
-                # Write global metadata
-                mf.write(f"title={book_title if book_title else orig_name}\n")
-                # Optionally, set album or artist metadata
-                mf.write(f"artist=FishSpeech TTS\n")
-                # Generate chapter metadata entries
-                start_ms = 0
-                for idx, (title, chap_file) in enumerate(chapter_files, start=1):
-                    end_ms = start_ms + (chapter_durations_ms[idx-1] - 1 if chapter_durations_ms[idx-1] > 0 else 0)
-                    mf.write("[CHAPTER]\n")
-                    mf.write("TIMEBASE=1/1000\n")
-                    mf.write(f"START={start_ms}\n")
-                    mf.write(f"END={end_ms}\n")
-                    chapter_title = title or f"Chapter {idx}"
-                    # Escape any special characters in title if needed
-                    chapter_title = chapter_title.replace("\n", " ").strip()
-                    mf.write(f"title={chapter_title}\n")
-                    start_ms = end_ms + 1
-        # Create file list for ffmpeg concat
-        list_path = os.path.join(out_dir, "chapters_list.txt")
-        with open(list_path, "w", encoding="utf-8") as lf:
-            for _, chap_file in chapter_files:
-                # ffmpeg concat requires paths properly escaped/quoted
-                lf.write(f"file '{chap_file}'\n")
-        # Determine final output file name and path
-        base_name = os.path.splitext(orig_name)[0]
-        final_file_name = f"{base_name}.{output_format.lower()}"
-        final_path = os.path.join(out_dir, final_file_name)
-        
-        log_message(f"Final output file will be: {final_path}")
+        if encoder is not None:
+            audio_seconds = encoder.duration_seconds
+        else:
+            chapter_durations_ms = []
+            for (title, chap_file) in chapter_files:
+                # Get duration in ms using wave module (since we saved as wav)
+                try:
+                    w = wave.open(chap_file, 'rb')
+                    frames = w.getnframes()
+                    rate = w.getframerate()
+                    w.close()
+                    # integer milliseconds
+                    duration_ms = int(frames * 1000 / rate)
+                except Exception:
+                    duration_ms = 0
+                chapter_durations_ms.append(duration_ms)
+            audio_seconds = sum(chapter_durations_ms) / 1000
+        # 记录本次吞吐量，供转换预估使用；部分句子来自分段存储时耗时偏短，不记录
+        try:
+            if store is not None and store.hits > store_hits:
+                log_message("Segments reused from the store, throughput not recorded")
+            elif profiler.enabled:
+                log_message("Profiling enabled, throughput not recorded")
+            else:
+                record_throughput(sum(len(ch["text"]) for ch in selected_chapters),
+                                  sum(count_requests(ch["text"])[1] for ch in selected_chapters),
+                                  synthesis_elapsed,
+                                  audio_seconds=audio_seconds,
+                                  mode=MODE_UI)
+        except Exception as e:
+            log_error(f"Failed to record throughput: {str(e)}", e)
+
+        if encoder is None:
+            # 按时长/大小在章节边界分卷，每卷单独的章节元数据与 FFmpeg 进程
+            parts = split_parts([d / 1000 for d in chapter_durations_ms], part_seconds)
+            cmds, output_paths = [], []
+            for number, indices in enumerate(parts, start=1):
+                single = len(parts) == 1
+                suffix = "" if single else f"_part{number:02d}"
+                output_path = final_path if single else part_path(final_path, number)
+                # Prepare metadata file for chapters
+                metadata_path = None
+                if output_format.lower() in CHAPTER_FORMATS:
+                    metadata_path = os.path.join(out_dir, f"chapters{suffix}.txt")
+                    chapter_marks = []
+                    start_ms = 0
+                    for i in indices:
+                        duration_ms = chapter_durations_ms[i]
+                        end_ms = start_ms + (duration_ms - 1 if duration_ms > 0 else 0)
+                        chapter_marks.append((chapter_files[i][0], start_ms, end_ms))
+                        start_ms = end_ms + 1
+                    title = book_title if book_title else orig_name
+                    write_ffmetadata(metadata_path, title if single else f"{title} - Part {number}", chapter_marks)
+                # Create file list for ffmpeg concat
+                list_path = os.path.join(out_dir, f"chapters_list{suffix}.txt")
+                write_concat_list(list_path, [chapter_files[i][1] for i in indices])
+                cmds.append(concat_command(list_path, output_format, output_path, metadata_path))
+                output_paths.append(output_path)
+
+            # 将命令输出到日志，方便调试
+            cmd_str = "<br>".join(html.escape(" ".join(cmd)) for cmd in cmds)
+            yield f"<p>执行命令: <code>{cmd_str}</code></p>", None, None
         
         # 在开始合并前显示进度
         yield f"所有章节已合成。正在合并为有声书: {final_file_name}...", None, None
         
-        # 在开始合并前删除可能存在的旧文件
-        if os.path.exists(final_path):
-            try:
-                os.remove(final_path)
-            except Exception as e:
-                yield f"<p style='color:orange'>警告：无法删除旧文件: {str(e)}</p>", None, None
-    
-        # Construct ffmpeg command for merging
-        cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
-        if os.path.exists(metadata_path):
-            cmd += ["-i", metadata_path, "-map_metadata", "1"]
-        
-        # Choose codec based on output format
-        fmt = output_format.lower()
-        if fmt in ["m4b", "m4a", "mp4", "mov"]:
-            # Use AAC codec for MP4/M4A/M4B
-            cmd += ["-c:a", "aac", "-b:a", "128k"]
-        elif fmt == "mp3":
-            cmd += ["-c:a", "libmp3lame", "-b:a", "192k"]
-        elif fmt == "flac":
-            cmd += ["-c:a", "flac"]
-        elif fmt == "wav":
-            # PCM for WAV
-            cmd += ["-c:a", "pcm_s16le"]
-        elif fmt == "aac":
-            # AAC ADTS format
-            cmd += ["-c:a", "aac", "-b:a", "128k"]
-        else:
-            # default to codec copy if unknown, though ideally never here
-            cmd += ["-c", "copy"]
-        cmd += [final_path]
-        
-        # 将命令输出到日志，方便调试
-        cmd_str = " ".join(cmd)
-        log_message(f"FFmpeg command: {cmd_str}")
-        yield f"<p>执行命令: <code>{cmd_str}</code></p>", None, None
-        
-        # 使用直接的subprocess.run而不是Popen，简化逻辑
+        # 不阻塞事件循环中的其他请求，各分卷并行编码
         try:
             log_message("Starting FFmpeg process")
-            process = subprocess.run(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False  # 不自动抛出异常
-            )
+            with profiler.phase("merge"):
+                if encoder is not None:
+                    returncode, stderr = await encoder.finish()
+                    output_paths = encoder.output_paths
+                else:
+                    returncode, stderr = await run_ffmpeg_parallel(cmds)
             
-            log_message(f"FFmpeg returned with code: {process.returncode}")
+            log_message(f"FFmpeg returned with code: {returncode}")
             
             # 检查是否成功
-            if process.returncode == 0:
+            if returncode == 0:
                 # 验证文件状态
-                file_status = log_file_status(final_path)
+                for output_path in output_paths:
+                    log_file_status(output_path)
+                missing = [p for p in output_paths if not os.path.exists(p) or os.path.getsize(p) == 0]
                 
                 # 确认文件存在且可读
-                if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
+                if not missing:
                     # 尝试读取确保文件完整
                     try:
-                        with open(final_path, 'rb') as f:
-                            f.seek(0)
+                        for output_path in output_paths:
+                            with open(output_path, 'rb') as f:
+                                f.seek(0)
                             
                         log_message("✅ Successfully verified output file")
+                        if store is not None:
+                            # 输出已完成，不再需要续转数据
+                            discard_segment_store(store)
                         
                         # 成功生成，显示结果 - 使用yield而不是return确保流程完整
+                        file_names = "<br>".join(html.escape(os.path.basename(p)) for p in output_paths)
                         success_html = f"""
                         <div style='padding: 15px; border: 1px solid #28a745; border-radius: 5px; margin: 10px 0;'>
                             <h3 style='color: #28a745; margin-bottom: 10px;'>✅ 音频转换完成</h3>
-                            <p>文件路径: {os.path.basename(final_path)}</p>
+                            <p>文件路径: {file_names}</p>
                             <p><strong>👉 请点击下方按钮下载有声书</strong></p>
                         </div>
                         """
                         log_message("Yielding success message")
-                        yield success_html, None, final_path
+                        yield success_html, None, output_paths
                         log_message("Yield complete")
                         return
                     except Exception as e:
                         log_error(f"File access error: {str(e)}", e)
                         yield f"<p style='color:red'>文件访问错误: {str(e)}</p>", None, None
                 else:
-                    log_error(f"Output file not found or empty: {final_path}")
-                    yield f"<p style='color:red'>错误: FFmpeg运行成功但找不到输出文件: {final_path}</p>", None, None
+                    log_error(f"Output file not found or empty: {missing}")
+                    yield f"<p style='color:red'>错误: FFmpeg运行成功但找不到输出文件: {', '.join(missing)}</p>", None, None
             else:
                 # 命令执行失败
-                stderr = process.stderr
                 log_error(f"FFmpeg error: {stderr}")
                 yield f"<p style='color:red'>FFmpeg错误: {stderr}</p>", None, None
                 
@@ -331,6 +428,22 @@ def convert_to_audio(state, reference_audio, output_format, start_chapter, end_c
     except Exception as e:
         log_error(f"Unexpected error in convert_to_audio: {str(e)}", e)
         yield f"<p style='color:red'>处理过程中出现未知错误: {str(e)}</p>", None, None
+    finally:
+        if encoder is not None:
+            await encoder.abort()
+        profiler.close()
+
+def estimate_conversion(state, output_format, start_chapter, end_chapter, stream_encode=True):
+    """Dry-run planner: request counts, audio duration, disk usage and ETA without calling the server"""
+    if not state or "chapters" not in state:
+        return "No chapters to convert. Please upload and parse a book first."
+    chapters = state["chapters"]
+    total_chapters = len(chapters)
+    start_chapter = max(1, min(int(start_chapter), total_chapters))
+    end_chapter = max(start_chapter, min(int(end_chapter), total_chapters))
+    report = format_plan(plan_conversion(chapters, start_chapter, end_chapter, output_format, mode=MODE_UI,
+                                         intermediate_wav=not stream_encode))
+    return f"<pre style='white-space: pre-wrap;'>{html.escape(report)}</pre>"
 
 def create_ui():
     """Construct and return the Gradio Blocks interface."""
@@ -358,16 +471,28 @@ def create_ui():
             end_chapter = gr.Number(label="结束章节", value=1, minimum=1, step=1)
         
         output_format = gr.Dropdown(label="输出格式", choices=["m4b","mp3","wav","aac","flac"], value="m4b")
-        convert_btn = gr.Button("转换为有声书")
+        stream_encode = gr.Checkbox(label="流式编码 (合成结果直接送入 FFmpeg，不生成临时 WAV 文件)", value=True)
+        resume = gr.Checkbox(label="断点续转 (保存已合成的句子以便中断后继续，完成后自动删除)", value=False)
+        with gr.Row():
+            part_hours = gr.Number(label="分卷时长上限 (小时，0 表示不分卷)", value=0, minimum=0)
+            part_size_mb = gr.Number(label="分卷大小上限 (MB，0 表示不分卷)", value=0, minimum=0)
+        profile_jobs = gr.Checkbox(label="性能分析 (在 output 目录生成 .pstats 与火焰图文件)", value=False)
+        with gr.Row():
+            estimate_btn = gr.Button("预估转换")
+            convert_btn = gr.Button("转换为有声书")
         progress = gr.HTML(label="进度")
         audio_output = gr.HTML(label="音频预览")
-        download_output = gr.File(label="下载有声书", interactive=False)
+        download_output = gr.File(label="下载有声书", file_count="multiple", interactive=False)
         
         # Setup interactions
         state = gr.State()
-        parse_btn.click(fn=parse_book, 
-                       inputs=book_file, 
+        parse_event = parse_btn.click(fn=parse_book, 
+                       inputs=[book_file, profile_jobs], 
                        outputs=[chapters_preview, state])
+        # 解析完成后在后台预合成章节试听
+        parse_event.then(fn=prefetch_chapter_previews,
+                         inputs=[state, ref_audio],
+                         outputs=None)
                        
 
         def update_chapter_range(state):
@@ -380,17 +505,30 @@ def create_ui():
                        inputs=state,
                        outputs=[start_chapter, end_chapter])
 
+        # 不限制 Gradio 每个事件的并发，由 TTSScheduler 决定何时向服务器发送请求
         test_voice_btn.click(fn=test_voice_cloning,
                            inputs=ref_audio,
-                           outputs=[preview_status, preview_audio])
+                           outputs=[preview_status, preview_audio],
+                           concurrency_limit=None)
                            
 
+        chapter_index.change(fn=prefetch_selected_chapter,
+                             inputs=[state, ref_audio, chapter_index],
+                             outputs=None)
+
         test_chapter_btn.click(fn=test_chapter_synthesis,
                              inputs=[state, ref_audio, chapter_index],
-                             outputs=[preview_status, preview_audio])
+                             outputs=[preview_status, preview_audio],
+                             concurrency_limit=None)
                              
+        estimate_btn.click(fn=estimate_conversion,
+                          inputs=[state, output_format, start_chapter, end_chapter, stream_encode],
+                          outputs=progress)
+
         convert_btn.click(fn=convert_to_audio, 
-                         inputs=[state, ref_audio, output_format, start_chapter, end_chapter], 
+                         inputs=[state, ref_audio, output_format, start_chapter, end_chapter, profile_jobs, stream_encode,
+                                 part_hours, part_size_mb, resume], 
                          outputs=[progress, audio_output, download_output],
-                         show_progress="full")  # 启用完整进度显示
+                         show_progress="full",
+                         concurrency_limit=None)  # 启用完整进度显示
     return demo